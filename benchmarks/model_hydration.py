@@ -0,0 +1,86 @@
+"""Times turning [rows] streamer_messages rows into models"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import settings  # noqa: E402
+
+settings.db_name = ':memory:'
+settings.db_slow_query_ms = 0
+
+from modules import database  # noqa: E402
+
+
+def seed(count):
+    database.get_StreamerMessage()  # builds the tables
+
+    # messages need their streamer and channel rows to exist
+    database.execute_many(
+        'INSERT INTO streamers (twitch_id, username) VALUES (?, ?)',
+        [(str(i), 'streamer{}'.format(i)) for i in range(500)]
+    )
+    database.execute_many(
+        """
+            INSERT INTO
+                streamer_channels
+                (streamer_id, channel_did, template)
+            VALUES
+                (?, ?, '')
+        """,
+        [(i + 1, str(i % 50)) for i in range(500)]
+    )
+    database.execute_many(
+        """
+            INSERT INTO
+                streamer_messages
+                (streamer_id, channel_did, message_did)
+            VALUES
+                (?, ?, ?)
+        """,
+        [(i % 500 + 1, str(i % 50), str(i)) for i in range(count)]
+    )
+
+
+def time_hydration(model, repeat=5):
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        models = model.get_all()
+        elapsed = time.perf_counter() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    return len(models), best
+
+
+def measure_memory(model):
+    tracemalloc.start()
+    models = model.get_all()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return size / len(models)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    seed(count)
+    model = database.get_StreamerMessage()
+
+    rows, elapsed = time_hydration(model)
+    print('{} rows in {:.3f}s: {:,.0f} rows/s, {:.0f} bytes/row'.format(
+        rows,
+        elapsed,
+        rows / elapsed,
+        measure_memory(model)
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""Times the models' queries, exiting 1 if any of them scans a table"""
+
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import settings  # noqa: E402
+
+settings.db_name = ':memory:'
+settings.db_slow_query_ms = 0
+
+from modules import database  # noqa: E402
+
+SCAN = re.compile(r'^SCAN\b')
+NAMED_PARAMETER = re.compile(r':(\w+)')
+TABLES = (
+    'command_aliases',
+    'streamers',
+    'streamer_channels',
+    'streamer_messages',
+    'users',
+    'user_servers',
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+def seed(count):
+    database.migrations.ensure()  # builds the tables
+
+    database.execute_many(
+        'INSERT INTO command_aliases (command, alias) VALUES (?, ?)',
+        [('command{}'.format(i), 'alias{}'.format(i)) for i in range(count)]
+    )
+    database.execute_many(
+        'INSERT INTO streamers (twitch_id, username) VALUES (?, ?)',
+        [(str(i), 'streamer{}'.format(i)) for i in range(count)]
+    )
+    database.execute_many(
+        """
+            INSERT INTO
+                streamer_channels
+                (streamer_id, channel_did, template)
+            VALUES
+                (?, ?, '')
+        """,
+        [(i + 1, str(i % 50)) for i in range(count)]
+    )
+    database.execute_many(
+        """
+            INSERT INTO
+                streamer_messages
+                (streamer_id, channel_did, message_did)
+            VALUES
+                (?, ?, ?)
+        """,
+        [(i + 1, str(i % 50), str(i)) for i in range(count)]
+    )
+    database.execute_many(
+        """
+            INSERT INTO
+                users
+                (user_did, global_admin, blacklisted)
+            VALUES
+                (?, 0, 0)
+        """,
+        [(str(i), ) for i in range(count)]
+    )
+    database.execute_many(
+        """
+            INSERT INTO
+                user_servers
+                (user_id, server_did, admin, blacklisted)
+            VALUES
+                (?, ?, 1, 0)
+        """,
+        [(i + 1, str(i % 50)) for i in range(count)]
+    )
+
+
+def run_lookups():
+    # the shapes of query made by the models, Twitch loop and handlers
+    database.get_CommandAlias_by_alias('alias1')
+    database.get_User_by_user_did('1')
+    database.get_UserServer().get_by(user_id=2, server_did='2')
+
+    streamer = database.get_Streamer_by_username('streamer1')
+    streamer.streamer_channels
+    streamer.streamer_messages
+
+    streamer_channel = database.get_StreamerChannel().get_by(
+        streamer_id=streamer.id,
+        channel_did='1'
+    )
+    streamer_channel.streamer_messages
+    database.get_StreamerChannel_by_id(streamer_channel.id)
+
+    user = database.get_User_by_id(1)
+    user.user_servers
+
+    database.get_Streamer().get_list_by(
+        id__in=range(1, 101),
+        prefetch=('streamer_channels.streamer_messages', 'streamer_messages')
+    )
+    database.get_User().get_list_by(
+        id__in=range(1, 101),
+        prefetch=('user_servers', )
+    )
+
+    try:
+        with database.transaction():
+            streamer.twitch_id = 'changed'
+            streamer.save()
+
+            message = database.get_StreamerMessage_by_id(1)
+            message.delete(delete_discord_message=False)
+
+            user.delete()
+
+            raise Rollback()
+
+    except Rollback:
+        pass
+
+
+def get_statements():
+    return [
+        summary['template']
+        for summary in database.query_stats.report(limit=None)
+        if ' WHERE ' in summary['template']
+    ]
+
+
+def get_cascade_lookups():
+    for table in TABLES:
+        keys = {}
+        for row in database.fetch_all(
+            "pragma foreign_key_list('{}')".format(table)
+        ):
+            keys.setdefault(row['id'], []).append(row['from'])
+
+        for columns in keys.values():
+            yield 'SELECT 1 FROM {} WHERE {}'.format(
+                table,
+                ' AND '.join('{} = ?'.format(column) for column in columns)
+            )
+
+
+def explain(statement):
+    # the plan doesn't depend on the values, so every parameter is NULL
+    names = NAMED_PARAMETER.findall(statement)
+    if names:
+        parameters = {name: None for name in names}
+
+    else:
+        parameters = [None] * statement.count('?')
+
+    rows = database.fetch_all('EXPLAIN QUERY PLAN ' + statement, parameters)
+
+    return [row[-1] for row in rows]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    seed(count)
+    database.query_stats.reset()
+
+    for _ in range(100):
+        run_lookups()
+
+    timings = database.query_stats.format_report(order_by='p95', limit=None)
+    statements = get_statements() + list(get_cascade_lookups())
+    failures = 0
+    sorts = 0
+
+    for statement in statements:
+        plan = explain(statement)
+        scans = [step for step in plan if SCAN.match(step)]
+        failures += bool(scans)
+        # sorting the matched rows isn't a failure, but is worth knowing
+        sorts += any(step.startswith('USE TEMP B-TREE') for step in plan)
+
+        print('{} {}'.format('FAIL' if scans else 'ok  ', statement))
+        for step in plan:
+            print('         {}'.format(step))
+
+    print('\n{} statements checked, {} scanning, {} sorting'.format(
+        len(statements),
+        failures,
+        sorts
+    ))
+    print('\n' + timings)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
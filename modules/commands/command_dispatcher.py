@@ -93,8 +93,10 @@ class CommandDispatcher:
         return alias.command if alias else command
 
     def dispatch(self, command, message):
-        user_level = UserLevel.get(message.author, message.channel)
-        dispatcher, attributes = self.get(command, user_level)
+        with database.scope():
+            user_level = UserLevel.get(message.author, message.channel)
+            dispatcher, attributes = self.get(command, user_level)
+
         handlers = [h
                     for h
                     in dispatcher.handlers
@@ -113,7 +115,9 @@ class CommandDispatcher:
     async def _wrapper(self, handler, attributes, message, command):
         try:
             binding = self._get_binding_for(handler, attributes, message)
-            await handler.coroutine(*binding.args, **binding.kwargs)
+
+            with database.scope():
+                await handler.coroutine(*binding.args, **binding.kwargs)
 
         except CommandException as ex:
             await self._bot.send_message(message.channel, str(ex))
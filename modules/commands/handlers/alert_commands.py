@@ -67,19 +67,17 @@ class AlertCommands:
                 ' underscores, and must be between 4 and 25 characters long.'
             )
 
-        streamer = self.ensure_streamer(username)
-
         channel = self.get_channel(channel_name, message)
 
         if channel.is_private:
-            raise CommandException('Alerts in private channels are currently'
-                                   ' disabled.')
+            raise CommandException('Alerts in private channels are'
+                                   ' currently disabled.')
 
         self.check_permission(message.author, channel)
 
-        self.build_streamer_channel(
+        streamer = await database.aio.run(
+            self.add_alert,
             username,
-            streamer,
             channel,
             template
         )
@@ -94,6 +92,21 @@ class AlertCommands:
             )
         )
 
+    def add_alert(self, username, channel, template):
+        # runs on the database worker; an alert that already exists
+        # shouldn't leave an orphaned streamer
+        with database.transaction():
+            streamer = self.ensure_streamer(username)
+
+            self.build_streamer_channel(
+                username,
+                streamer,
+                channel,
+                template
+            )
+
+        return streamer
+
     def ensure_streamer(self, username):
         streamer = database.get_Streamer_by_username(username.lower())
 
@@ -184,16 +197,20 @@ class AlertCommands:
         return bool(streamer_channels)
 
     async def cmd_remove_alert(self, message, username, channel_name='here'):
-        streamer = self.get_streamer(username)
+        streamer = await database.aio.run(self.get_streamer, username)
 
         channel = self.get_channel(channel_name, message)
 
         self.check_permission(message.author, channel)
 
-        streamer_channel = self.get_streamer_channel(username, streamer,
-                                                     channel)
+        streamer_channel = await database.aio.run(
+            self.get_streamer_channel,
+            username,
+            streamer,
+            channel
+        )
 
-        streamer_channel.delete()
+        await streamer_channel.delete_async()
 
         await self.bot.send_message(
             message.channel,
@@ -203,6 +220,9 @@ class AlertCommands:
             )
         )
 
+        await database.aio.run(self.delete_unused_streamer, streamer)
+
+    def delete_unused_streamer(self, streamer):
         if not streamer.streamer_channels:
             streamer.delete()
 
@@ -230,10 +250,13 @@ class AlertCommands:
         return streamer_channel
 
     async def cmd_list_alerts(self, message, username_filter=''):
+        streamers = await database.aio.read_Streamer_list(
+            prefetch=('streamer_channels.streamer', )
+        )
         alerts = list(self.get_streamer_channels(
             message,
             username_filter.lower(),
-            database.get_Streamer_list()
+            streamers
         ))
 
         await self.bot.send_message(
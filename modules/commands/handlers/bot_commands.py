@@ -1,10 +1,13 @@
 import discord
 import settings
+import tempfile
 
 from collections import defaultdict
 from datetime import datetime
 from discord import NotFound, Forbidden
+from modules import database
 from modules import UserLevel
+from .. import CommandException
 
 
 class BotCommands:
@@ -74,10 +77,22 @@ class BotCommands:
             user_level=UserLevel.server_bot_admin,
             description=(
                 'Replies in private with the current timestamp (in'
-                ' international ISO format) and the current database file'
-                ' attached. Changes to the database made in the last second'
-                ' may not be reflected in the file, as they may not have'
-                ' been committed yet.'
+                ' international ISO format) and a gzipped snapshot of the'
+                ' database attached. Changes to the database made in the last'
+                ' second may not be reflected in the snapshot, as they may not'
+                ' have been committed yet.'
+            )
+        )
+        commands.register_handler(
+            'database stats',
+            self.cmd_database_stats,
+            user_level=UserLevel.bot_owner,
+            description=(
+                'Replies in private with the statements the database has spent'
+                ' the most time on since startup, with their counts, latency'
+                " percentiles and rows, after the statement cache's hits and"
+                ' misses. Order by `total`, `count`, `p50`, `p95`, `p99` or'
+                ' `rows`'
             )
         )
 
@@ -211,10 +226,32 @@ class BotCommands:
             pass
 
     async def cmd_backup(self, message):
-        await self.bot.send_file(
+        content = 'BACKUP ' + datetime.now().isoformat(' ')
+
+        with tempfile.TemporaryDirectory() as directory:
+            # copied on a read thread, so nothing waits for it
+            path = await database.aio.read(database.backups.create, directory)
+
+            await self.bot.send_file(message.author, path, content=content)
+
+    async def cmd_database_stats(self, message, order_by='total'):
+        if order_by not in ('total', 'count', 'p50', 'p95', 'p99', 'rows'):
+            raise CommandException(
+                'Unrecognised order `{}`'.format(order_by)
+            )
+
+        # first, so a long report being cut short doesn't lose it
+        text = (
+            'Statement cache: {hits} hits, {misses} misses, '
+            '{statements} statements\n\n{report}'
+        ).format(
+            report=database.query_stats.format_report(order_by),
+            **database.statements.stats()
+        )
+
+        await self.bot.send_message(
             message.author,
-            settings.db_name,
-            content='BACKUP ' + datetime.now().isoformat(' ')
+            '```\n{}\n```'.format(text[:1900])
         )
 
     async def cmd_source(self, message):
@@ -7,6 +7,8 @@ from .. import CommandException
 
 
 class ModelCommands:
+    message_limit = 1900
+
     def __init__(self, commands):
         self.bot = commands.bot
         self.register(commands)
@@ -91,7 +93,7 @@ class ModelCommands:
         self.set_model_attributes(model, pairs)
 
         try:
-            model.save()
+            await model.save_async()
 
         except IntegrityError:
             raise CommandException(
@@ -140,11 +142,15 @@ class ModelCommands:
         if len(pairs) < 2:
             raise CommandException(syntax_message)
 
-        model = self.search_for_model(model, *pairs.pop(0))
+        model = await database.aio.run(
+            self.search_for_model,
+            model,
+            *pairs.pop(0)
+        )
 
         self.set_model_attributes(model, pairs)
 
-        model.save()
+        await model.save_async()
 
         await self.bot.send_message(
             message.channel,
@@ -189,9 +195,13 @@ class ModelCommands:
         if len(pairs) != 1:
             raise CommandException(syntax_message)
 
-        model = self.search_for_model(model, *pairs[0])
+        model = await database.aio.run(
+            self.search_for_model,
+            model,
+            *pairs[0]
+        )
 
-        model.delete()
+        await model.delete_async()
 
         await self.bot.send_message(
             message.channel,
@@ -211,22 +221,39 @@ class ModelCommands:
         else:
             pairs = []
 
-        models = self.filter_model(model, pairs)
+        texts = await database.aio.read(
+            self.get_model_list,
+            self.filter_model(model, pairs)
+        )
 
-        if not models:
+        if not texts:
             return await self.bot.send_message(
                 message.channel,
                 'No `{}` records found'.format(model_name)
             )
 
-        await self.bot.send_message(
-            message.channel,
-            '\u200C\n' + '\n'.join(str(model) for model in models)
-        )
+        for text in texts:
+            await self.bot.send_message(message.channel, '\u200C' + text)
 
     def filter_model(self, model, pairs):
-        if pairs:
-            list_filter = {field: value for field, value in pairs}
-            return model.get_list_by(**list_filter)
+        list_filter = {field: value for field, value in pairs}
+        return model.iter_list_by(**list_filter)
+
+    def get_model_list(self, models):
+        # runs on a database thread, returning the text of each message
+        texts = []
+        text = ''
+
+        for model in models:
+            line = '\n' + str(model)
+
+            if text and len(text) + len(line) > self.message_limit:
+                texts.append(text)
+                text = ''
+
+            text += line
+
+        if text:
+            texts.append(text)
 
-        return model.get_all()
+        return texts
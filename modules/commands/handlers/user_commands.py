@@ -4,6 +4,9 @@ from .. import CommandException
 
 
 class UserCommands:
+    page_size = 100
+    message_limit = 1900
+
     def __init__(self, commands):
         self.bot = commands.bot
         self.user_level = UserLevel.server_owner
@@ -65,34 +68,43 @@ class UserCommands:
                            servername='here'):
         server = self.get_server(servername, message)
         duser = self.get_discord_user(server, username)
-        user = self.ensure_user(server, duser)
-        userserver = self.ensure_userserver(server, user)
 
-        if usertype == 'admin':
-            userserver.admin = True
-            userserver.save()
+        await database.aio.run(self.set_usertype, server, duser, usertype,
+                               True)
 
-            return await self.bot.send_message(
-                message.channel,
-                'Admin `{!s}` added to `{}` successfully'.format(
-                    duser,
-                    server.name
-                )
+        return await self.bot.send_message(
+            message.channel,
+            '{} `{!s}` added to `{}` successfully'.format(
+                self.get_usertype_name(usertype),
+                duser,
+                server.name
             )
+        )
 
-        elif usertype == 'blacklist':
-            userserver.blacklisted = True
-            userserver.save()
+    def set_usertype(self, server, duser, usertype, value):
+        # runs on the database worker
+        with database.transaction():
+            user = self.ensure_user(server, duser)
+            userserver = self.ensure_userserver(server, user)
 
-            return await self.bot.send_message(
-                message.channel,
-                'Blacklist `{!s}` added to `{}` successfully'.format(
-                    duser,
-                    server.name
+            if usertype == 'admin':
+                userserver.admin = value
+
+            elif usertype == 'blacklist':
+                userserver.blacklisted = value
+
+            else:
+                raise CommandException(
+                    'Unknown user type `{}`'.format(usertype)
                 )
-            )
 
-        raise CommandException('Unknown user type `{}`'.format(usertype))
+            userserver.save()
+
+            if not value:
+                self.clean_up(user, userserver)
+
+    def get_usertype_name(self, usertype):
+        return 'Admin' if usertype == 'admin' else 'Blacklist'
 
     def get_server(self, name, message):
         if name.lower() == 'here':
@@ -171,38 +183,18 @@ class UserCommands:
                               servername='here'):
         server = self.get_server(servername, message)
         duser = self.get_discord_user(server, username)
-        user = self.ensure_user(server, duser)
-        userserver = self.ensure_userserver(server, user)
-
-        if usertype == 'admin':
-            userserver.admin = False
-            userserver.save()
-
-            self.clean_up(user, userserver)
-
-            return await self.bot.send_message(
-                message.channel,
-                'Admin `{!s}` removed from `{}` successfully'.format(
-                    duser,
-                    server.name
-                )
-            )
-
-        elif usertype == 'blacklist':
-            userserver.blacklisted = False
-            userserver.save()
 
-            self.clean_up(user, userserver)
+        await database.aio.run(self.set_usertype, server, duser, usertype,
+                               False)
 
-            return await self.bot.send_message(
-                message.channel,
-                'Blacklist `{!s}` removed from `{}` successfully'.format(
-                    duser,
-                    server.name
-                )
+        return await self.bot.send_message(
+            message.channel,
+            '{} `{!s}` removed from `{}` successfully'.format(
+                self.get_usertype_name(usertype),
+                duser,
+                server.name
             )
-
-        raise CommandException('Unknown user type `{}`'.format(usertype))
+        )
 
     def clean_up(self, user, userserver):
         if not userserver.admin and not userserver.blacklisted:
@@ -213,19 +205,53 @@ class UserCommands:
 
     async def cmd_list_users(self, message, listtype='both', servername='',
                              username=''):
-        users = database.get_User_list()
-
         if servername:
             server = self.get_server(servername, message)
         else:
             server = None
 
-        text = await self.get_list_text(users, username, listtype, server,
-                                        message)
+        # users are read a page at a time and each message is sent as soon
+        # as it fills, so large tables never have to be loaded in one go
+        text = ''
+        found = False
+        offset = 0
+
+        while True:
+            users = await database.aio.read_User_list(
+                prefetch=('user_servers', ),
+                limit=self.page_size,
+                offset=offset
+            )
+
+            for piece in await self.get_list_pieces(users, username, listtype,
+                                                    server, message):
+                found = True
+                piece = '\n' + piece
+
+                if text and len(text) + len(piece) > self.message_limit:
+                    await self.send_list_text(message, text)
+                    text = ''
+
+                text += piece
 
-        await self.bot.send_message(message.channel, text)
+            if len(users) < self.page_size:
+                break
 
-    async def get_list_text(self, users, username, listtype, server, message):
+            offset += self.page_size
+
+        if not found:
+            return await self.bot.send_message(
+                message.channel,
+                'No `users` found.'
+            )
+
+        await self.send_list_text(message, text)
+
+    async def send_list_text(self, message, text):
+        await self.bot.send_message(message.channel, '\u200C' + text)
+
+    async def get_list_pieces(self, users, username, listtype, server,
+                              message):
         pieces = []
 
         for user in users:
@@ -243,10 +269,7 @@ class UserCommands:
                     await self.get_list_text_piece(user, userserver, server)
                 )
 
-        if not pieces:
-            return 'No `users` found.'
-
-        return '\u200C\n{}'.format('\n'.join(pieces))
+        return pieces
 
     def check_listtype(self, userserver, listtype):
         if listtype == 'admin':
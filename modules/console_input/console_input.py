@@ -2,6 +2,7 @@ import traceback
 import asyncio
 
 from concurrent.futures import CancelledError
+from modules import database
 
 
 class ConsoleInput:
@@ -11,6 +12,7 @@ class ConsoleInput:
         self.is_ready = asyncio.Event()
         self.commands = (
             'exit',
+            'database stats',
         )
 
         self.disable_daemon_thread_exit()
@@ -48,6 +50,10 @@ class ConsoleInput:
                 await self.bot.close()
                 return
 
+            if message == 'database stats':
+                print(database.query_stats.format_report())
+                continue
+
             try:
                 exec(
                     'async def console(bot):\n' +
@@ -0,0 +1,96 @@
+import asyncio
+
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from .identity_map import get_current_task
+
+
+class AsyncDatabase:
+    """Awaitable mirror of the database API, run on a worker thread"""
+
+    def __init__(self, database):
+        self.database = database
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.read_executor = ThreadPoolExecutor(
+            max_workers=max(1, database.connections.readers)
+        )
+
+    def __getattr__(self, name):
+        if name.startswith('get_'):
+            return partial(self.run, self._call_database, name)
+
+        if name.startswith('read_'):
+            return partial(self.read, self._call_database, 'get_' + name[5:])
+
+        raise AttributeError("'{}' object has no attribute '{}'".format(
+            type(self).__name__,
+            name
+        ))
+
+    def _call_database(self, name, *args, **kwargs):
+        return getattr(self.database, name)(*args, **kwargs)
+
+    @property
+    def loop(self):
+        if self.database.bot:
+            return self.database.bot.loop
+
+        return asyncio.get_event_loop()
+
+    async def run(self, func, *args, **kwargs):
+        await self._wait_for_transaction()
+
+        return await self.loop.run_in_executor(
+            self.executor,
+            self._for_task(partial(func, *args, **kwargs))
+        )
+
+    async def read(self, func, *args, **kwargs):
+        # for reads that can tolerate not seeing uncommitted writes, such as
+        # listing commands; these run alongside the writer
+        return await self.loop.run_in_executor(
+            self.read_executor,
+            self._for_task(partial(
+                self.database.call_as_reader,
+                func,
+                *args,
+                **kwargs
+            ))
+        )
+
+    async def _wait_for_transaction(self):
+        # an async transaction has the writer to itself until it ends, so
+        # other tasks queue behind it rather than joining it
+        database = self.database
+
+        while database.transaction_task not in (None, get_current_task()):
+            async with database.async_transaction_lock:
+                pass
+
+    def _for_task(self, func):
+        # captured here, on the loop, as the worker can't tell which task
+        # queued func
+        return partial(
+            self.database.call_for_task,
+            self.database.identity_map.current(),
+            self.database.deferring_commits,
+            func
+        )
+
+    async def execute(self, *args, **kwargs):
+        return await self.run(self.database.execute, *args, **kwargs)
+
+    async def fetch_all(self, *args, **kwargs):
+        return await self.run(self.database.fetch_all, *args, **kwargs)
+
+    async def fetch_row(self, *args, **kwargs):
+        return await self.run(self.database.fetch_row, *args, **kwargs)
+
+    async def fetch_value(self, *args, **kwargs):
+        return await self.run(self.database.fetch_value, *args, **kwargs)
+
+    async def insert(self, *args, **kwargs):
+        return await self.run(self.database.insert, *args, **kwargs)
+
+    async def update(self, *args, **kwargs):
+        return await self.run(self.database.update, *args, **kwargs)
@@ -0,0 +1,82 @@
+import os
+import re
+import gzip
+import shutil
+import asyncio
+import logging
+
+from datetime import datetime
+
+
+class Backups:
+    """Writes gzipped snapshots of the live database"""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.prefix = re.sub(r'\W+', '_', os.path.splitext(
+            os.path.basename(name)
+        )[0]).strip('_') or 'database'
+
+    def create(self, directory):
+        # blocks for the length of the copy, so keep it off the event loop
+        os.makedirs(directory, exist_ok=True)
+
+        path = os.path.join(directory, '{}-{}.db'.format(
+            self.prefix,
+            datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        ))
+
+        try:
+            if self.database.connections.in_memory:
+                with self.database.lock:
+                    self.database.connections.backup(path)
+
+            else:
+                self.database.connections.backup(path)
+
+            with open(path, 'rb') as source, \
+                    gzip.open(path + '.gz', 'wb') as target:
+                shutil.copyfileobj(source, target)
+
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+        return path + '.gz'
+
+    def rotate(self, directory, keep):
+        # names sort by the time they were taken
+        snapshots = sorted(
+            name for name in os.listdir(directory)
+            if name.startswith(self.prefix + '-') and name.endswith('.db.gz')
+        )
+
+        for name in snapshots[:-keep] if keep > 0 else []:
+            os.remove(os.path.join(directory, name))
+
+    def create_and_rotate(self, directory, keep):
+        path = self.create(directory)
+        self.rotate(directory, keep)
+
+        return path
+
+    async def run_schedule(self, interval, directory, keep):
+        bot = self.database.bot
+
+        while not bot.is_closed:
+            await asyncio.sleep(interval)
+
+            try:
+                path = await self.database.aio.read(
+                    self.create_and_rotate,
+                    directory,
+                    keep
+                )
+                logging.info('Database backed up to {}'.format(path))
+
+            except (KeyboardInterrupt, SystemExit, GeneratorExit,
+                    asyncio.CancelledError):
+                raise
+
+            except:
+                logging.exception('Error in scheduled database backup')
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+
+from collections import namedtuple, OrderedDict
+
+# model is the model's class name, operation is 'insert', 'update' or
+# 'delete', and fields is a frozenset of the fields written
+Change = namedtuple('Change', ('model', 'id', 'operation', 'fields'))
+
+
+class ChangeBus:
+    """Tells subscribers which model rows changed, once they're committed"""
+
+    def __init__(self, database):
+        self.database = database
+
+        self._subscribers = []
+        self._pending = []
+
+    @property
+    def active(self):
+        return bool(self._subscribers)
+
+    def wants(self, model_names):
+        # whether any subscriber is sent changes to one of these models
+        return any(
+            models is None or not models.isdisjoint(model_names)
+            for callback, models in self._subscribers
+        )
+
+    def subscribe(self, callback, models=None):
+        # models limits the changes sent to those of the named models
+        models = None if models is None else frozenset(models)
+        self._subscribers.append((callback, models))
+
+        return callback
+
+    def unsubscribe(self, callback):
+        self._subscribers = [
+            (subscriber, models) for subscriber, models in self._subscribers
+            if subscriber != callback
+        ]
+
+    def publish(self, changes):
+        if not self._subscribers:
+            return
+
+        with self.database.lock:
+            self._pending += changes
+
+            if not self.database.database.in_transaction:
+                self.commit()
+
+    def mark(self):
+        return len(self._pending)
+
+    def commit(self):
+        with self.database.lock:
+            changes = merge(self._pending)
+            del self._pending[:]
+
+        if changes:
+            self._dispatch(changes)
+
+    def rollback(self, mark=0):
+        with self.database.lock:
+            del self._pending[mark:]
+
+    def _dispatch(self, changes):
+        for callback, models in list(self._subscribers):
+            if models is not None:
+                selected = [c for c in changes if c.model in models]
+
+            else:
+                selected = list(changes)
+
+            if not selected:
+                continue
+
+            if asyncio.iscoroutinefunction(callback):
+                future = asyncio.run_coroutine_threadsafe(
+                    callback(selected),
+                    self.database.aio.loop
+                )
+                future.add_done_callback(log_failure)
+                continue
+
+            try:
+                callback(selected)
+
+            except:
+                logging.exception('Error in change subscriber {!r}'.format(
+                    callback
+                ))
+
+
+def merge(changes):
+    # one change per row: an insert absorbs later updates, a delete replaces
+    # what came before it, and a row inserted then deleted is left out
+    merged = OrderedDict()
+
+    for change in changes:
+        key = (change.model, change.id)
+        previous = merged.pop(key, None)
+
+        if previous is None:
+            merged[key] = change
+
+        elif change.operation == 'delete':
+            if previous.operation != 'insert':
+                merged[key] = change
+
+        else:
+            merged[key] = previous._replace(
+                fields=previous.fields | change.fields
+            )
+
+    return list(merged.values())
+
+
+def log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(
+            'Error in change subscriber',
+            exc_info=future.exception()
+        )
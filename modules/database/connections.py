@@ -0,0 +1,141 @@
+import os
+import queue
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+
+class ConnectionManager:
+    """Owns the single write connection and a pool of read-only connections"""
+
+    def __init__(self, name, readers=4, synchronous='NORMAL',
+                 cache_size=-16000, mmap_size=0, temp_store='MEMORY',
+                 cached_statements=256):
+        self.name = name
+        self.cached_statements = cached_statements
+        self.pragmas = (
+            ('synchronous', synchronous),
+            ('cache_size', cache_size),
+            ('mmap_size', mmap_size),
+            ('temp_store', temp_store),
+            ('foreign_keys', 'ON'),
+        )
+
+        self.in_memory = name == ':memory:' or name.startswith('file::memory:')
+        self.readers = 0 if self.in_memory else readers
+
+        self.writer = self._connect()
+        if not self.in_memory:
+            self.writer.execute('PRAGMA journal_mode = WAL').close()
+
+        self._pool = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _connect(self, readonly=False):
+        if readonly:
+            uri = 'file:{}?mode=ro'.format(
+                pathname2url(os.path.abspath(self.name))
+            )
+            connection = sqlite3.connect(
+                uri,
+                uri=True,
+                check_same_thread=False,
+                cached_statements=self.cached_statements
+            )
+
+        else:
+            connection = sqlite3.connect(
+                self.name,
+                check_same_thread=False,
+                cached_statements=self.cached_statements
+            )
+
+        connection.row_factory = sqlite3.Row
+
+        for pragma, value in self.pragmas:
+            if readonly and pragma == 'synchronous':
+                continue
+
+            connection.execute(
+                'PRAGMA {} = {}'.format(pragma, value)
+            ).close()
+
+        return connection
+
+    @contextmanager
+    def reader(self):
+        if not self.readers:
+            yield None
+            return
+
+        connection = self._acquire_reader()
+
+        try:
+            yield connection
+
+        finally:
+            self._pool.put(connection)
+
+    def _acquire_reader(self):
+        with self._lock:
+            if self._pool.empty() and self._opened < self.readers:
+                self._opened += 1
+                return self._connect(readonly=True)
+
+        return self._pool.get()
+
+    def report(self):
+        pragmas = ('journal_mode', ) + tuple(p for p, _ in self.pragmas)
+        report = []
+
+        for pragma in pragmas:
+            # in-memory databases return nothing for some, e.g. mmap_size
+            row = self.writer.execute('PRAGMA {}'.format(pragma)).fetchone()
+            report.append((pragma, row[0] if row else None))
+
+        return report
+
+    def backup(self, path, pages=256, sleep=0.005):
+        # a dedicated read connection holds one snapshot for the whole copy,
+        # so it's consistent, and under WAL the writer carries on meanwhile;
+        # in-memory databases can only be copied from the writer, which the
+        # caller must lock
+        target = sqlite3.connect(path)
+
+        try:
+            if self.in_memory:
+                copy(self.writer, target, pages, sleep)
+                return
+
+            source = self._connect(readonly=True)
+
+            try:
+                source.execute('BEGIN')
+                source.execute('SELECT COUNT(*) FROM sqlite_master').close()
+                copy(source, target, pages, sleep)
+
+            finally:
+                source.close()
+
+        finally:
+            target.close()
+
+    def checkpoint(self):
+        if not self.in_memory:
+            self.writer.execute('PRAGMA wal_checkpoint(TRUNCATE)').close()
+
+
+def copy(source, target, pages, sleep):
+    # Connection.backup() is only there from python 3.7; before that the
+    # source is dumped as sql, which reads inside the same snapshot
+    if hasattr(source, 'backup'):
+        source.backup(target, pages=pages, sleep=sleep)
+        return
+
+    target.isolation_level = None
+
+    for statement in source.iterdump():
+        target.execute(statement)
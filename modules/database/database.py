@@ -1,23 +1,194 @@
 import sys
-import sqlite3
+import time
+import asyncio
+import logging
 import settings
-
-from contextlib import closing
+import threading
+
+from functools import partial
+from contextlib import closing, contextmanager
+from .connections import ConnectionManager
+from .identity_map import IdentityMap, get_current_task
+from .mirror import Mirror
+from .migrations import Migrator
+from .statement_cache import StatementCache
+from .async_database import AsyncDatabase
+from .backups import Backups
+from .changes import ChangeBus
+from .query_stats import QueryStats
+from .transaction import Transaction, GroupCommit
 
 
 class Database:
     def __init__(self):
         self.bot = None
 
-        self.database = sqlite3.connect(settings.db_name)
-        self.database.row_factory = sqlite3.Row
+        self._prototypes = {}
+        self._finders = set()
+
+        self.connections = ConnectionManager(
+            settings.db_name,
+            readers=settings.db_read_connections,
+            synchronous=settings.db_synchronous,
+            cache_size=settings.db_cache_size,
+            mmap_size=settings.db_mmap_size,
+            temp_store=settings.db_temp_store
+        )
+
+        # shared with the async worker thread, so every use holds the lock
+        self.database = self.connections.writer
+        self.lock = threading.RLock()
+        self._local = threading.local()
+        self.transaction_depth = 0
+        self.transaction_task = None
+        self.group_commit_tasks = []
+        self._async_transaction_lock = None
+
+        self.identity_map = IdentityMap(settings.db_identity_map_size)
+        self.mirror = Mirror(self)
+        self.changes = ChangeBus(self)
+        self.statements = StatementCache()
+        self.migrations = Migrator(self)
+        self.aio = AsyncDatabase(self)
+        self.backups = Backups(self, settings.db_name)
+        self.query_stats = QueryStats(settings.db_slow_query_ms / 1000)
 
     def __call__(self, bot):
         self.bot = bot
 
+        # anything resolved before now was bound to models without a bot
+        self._prototypes.clear()
+        for name in self._finders:
+            delattr(self, name)
+        self._finders.clear()
+
+        self.report_pragmas()
+        self.migrations.ensure()
+        self.mirror.load(
+            type(self.get_model_prototype(name))
+            for name in settings.db_mirrored_models
+        )
+
+        if settings.db_backup_interval:
+            bot.loop.create_task(self.backups.run_schedule(
+                settings.db_backup_interval,
+                settings.db_backup_directory,
+                settings.db_backup_keep
+            ))
+
+    def report_pragmas(self):
+        with self.lock:
+            pragmas = self.connections.report()
+
+        logging.info('Database {} pragmas: {}'.format(
+            settings.db_name,
+            ', '.join('{}={}'.format(p, v) for p, v in pragmas)
+        ))
+
+        return pragmas
+
+    def checkpoint(self):
+        with self.lock:
+            self.connections.checkpoint()
+
+    def call_as_reader(self, func, *args, **kwargs):
+        # reads made by func go to a pooled read-only connection, which only
+        # sees committed data
+        with self.connections.reader() as connection:
+            self._local.reader = connection
+
+            try:
+                return func(*args, **kwargs)
+
+            finally:
+                self._local.reader = None
+
+    def call_for_task(self, scope, deferring, func):
+        # runs func on a worker thread as the task that queued it: inside
+        # its identity map scope, and deferring commits if it's in a group
+        # commit
+        previous = getattr(self._local, 'deferring', False)
+        self._local.deferring = deferring
+
+        try:
+            return self.identity_map.call_in(scope, func)
+
+        finally:
+            self._local.deferring = previous
+
+    @property
+    def deferring_commits(self):
+        # group commit only holds back writes made by the task that opened it
+        if getattr(self._local, 'deferring', False):
+            return True
+
+        task = get_current_task()
+        return task is not None and task in self.group_commit_tasks
+
+    @property
+    def reading_snapshot(self):
+        # true inside call_as_reader(), where only committed data is seen
+        return getattr(self._local, 'reader', None) is not None
+
+    @contextmanager
+    def _read_connection(self):
+        reader = getattr(self._local, 'reader', None)
+
+        if reader is not None:
+            yield reader
+
+        else:
+            with self.lock:
+                yield self.database
+
+    def scope(self):
+        return self.identity_map.scope()
+
+    def transaction(self):
+        return Transaction(self)
+
+    def group_commit(self, interval=None):
+        if interval is None:
+            interval = settings.db_group_commit_interval
+
+        return GroupCommit(self, interval)
+
+    @property
+    def async_transaction_lock(self):
+        if self._async_transaction_lock is None:
+            self._async_transaction_lock = asyncio.Lock()
+
+        return self._async_transaction_lock
+
+    def commit(self):
+        with self.lock:
+            self.database.commit()
+            self.mirror.commit()
+            self.changes.commit()
+
+    def rollback(self):
+        with self.lock:
+            self.database.rollback()
+            self.mirror.rollback()
+            self.changes.rollback()
+
+        # rows saved before the rollback may have handed out ids that no
+        # longer exist, so don't let the rolling back task's map resolve them
+        self.identity_map.clear_current()
+
+    def flush(self):
+        with self.lock:
+            if self.database.in_transaction and not self.transaction_depth:
+                self.commit()
+
     def __getattr__(self, name):
         if name.startswith('get_'):
-            return self.get_model_factory(name[4:].split('_'))
+            # resolved once, then found directly on the instance next time
+            factory = self.get_model_factory(name[4:].split('_'))
+            setattr(self, name, factory)
+            self._finders.add(name)
+
+            return factory
 
         raise AttributeError("'{}' object has no attribute '{}'".format(
             type(self).__name__,
@@ -33,9 +204,9 @@ class Database:
         model_name = attrs.pop(0)
 
         if not attrs:
-            return lambda: self.get_initialised_model(model_name)
+            return partial(self.get_initialised_model, model_name)
 
-        model = self.get_initialised_model(model_name)
+        model = self.get_model_prototype(model_name)
 
         if attrs.pop(0) == 'by':  # or 'list'
             func_name = 'get_by_{}'.format('_'.join(attrs))
@@ -50,6 +221,15 @@ class Database:
 
         return getattr(model, func_name)
 
+    def get_model_prototype(self, name):
+        # a shared blank instance that finders are bound to; never saved
+        try:
+            return self._prototypes[name]
+
+        except KeyError:
+            model = self._prototypes[name] = self.get_initialised_model(name)
+            return model
+
     def get_initialised_model(self, name):
         # imported here so database will be initialised when models import it
         from . import models
@@ -59,18 +239,44 @@ class Database:
     def execute(self, query, parameters=(), script=False, commit=True):
         parameters = self._convert_parameters(parameters)
 
-        with closing(self.database.cursor()) as cursor:
+        with self.lock, closing(self.database.cursor()) as cursor:
+            start = time.perf_counter()
+
             if script:
                 cursor.executescript(query)
 
             else:
                 cursor.execute(query, parameters)
 
-            if commit:
-                self.database.commit()
+            self.query_stats.record(
+                query,
+                time.perf_counter() - start,
+                cursor.rowcount
+            )
+
+            if commit and not (self.transaction_depth or
+                               self.deferring_commits):
+                self.commit()
 
             return cursor.lastrowid
 
+    def execute_many(self, query, parameters, commit=True):
+        with self.lock, closing(self.database.cursor()) as cursor:
+            start = time.perf_counter()
+            cursor.executemany(query, parameters)
+
+            self.query_stats.record(
+                query,
+                time.perf_counter() - start,
+                cursor.rowcount
+            )
+
+            if commit and not (self.transaction_depth or
+                               self.deferring_commits):
+                self.commit()
+
+            return cursor.rowcount
+
     def _convert_parameters(self, parameters):
         if isinstance(parameters, (tuple, list, dict)):
             return parameters
@@ -80,18 +286,79 @@ class Database:
     def fetch_all(self, query, parameters=()):
         parameters = self._convert_parameters(parameters)
 
-        with closing(self.database.cursor()) as cursor:
+        with self._read_connection() as connection, \
+                closing(connection.cursor()) as cursor:
+            start = time.perf_counter()
             cursor.execute(query, parameters)
+            rows = cursor.fetchall()
 
-            return cursor.fetchall()
+            self.query_stats.record(
+                query,
+                time.perf_counter() - start,
+                len(rows)
+            )
+
+            return rows
 
     def fetch_row(self, query, parameters=()):
         parameters = self._convert_parameters(parameters)
 
-        with closing(self.database.cursor()) as cursor:
+        with self._read_connection() as connection, \
+                closing(connection.cursor()) as cursor:
+            start = time.perf_counter()
             cursor.execute(query, parameters)
+            row = cursor.fetchone()
+
+            self.query_stats.record(
+                query,
+                time.perf_counter() - start,
+                int(row is not None)
+            )
+
+            return row
+
+    def fetch_chunks(self, query, parameters=(), chunk_size=500):
+        # yields lists of rows as the cursor reaches them; on the write
+        # connection the lock is only held while each chunk is read
+        parameters = self._convert_parameters(parameters)
+        reader = getattr(self._local, 'reader', None)
+        connection = reader or self.database
+
+        # timed across every chunk, leaving out time spent by the consumer
+        elapsed = [0.0]
+        count = 0
+
+        def timed(func, *args):
+            start = time.perf_counter()
+
+            try:
+                return func(*args)
+
+            finally:
+                elapsed[0] += time.perf_counter() - start
+
+        def locked(func, *args):
+            if reader is not None:
+                return timed(func, *args)
+
+            with self.lock:
+                return timed(func, *args)
+
+        try:
+            with closing(locked(connection.cursor)) as cursor:
+                locked(cursor.execute, query, parameters)
+
+                while True:
+                    rows = locked(cursor.fetchmany, chunk_size)
+
+                    if not rows:
+                        return
 
-            return cursor.fetchone()
+                    count += len(rows)
+                    yield rows
+
+        finally:
+            self.query_stats.record(query, elapsed[0], count)
 
     def fetch_value(self, query, parameters=(), *args, **kwargs):
         parameters = self._convert_parameters(parameters)
@@ -106,41 +373,78 @@ class Database:
             return kwargs.pop('default')
 
     def insert(self, table, fields):
-        query = 'INSERT INTO {} ({}) VALUES ({})'
+        fieldnames = tuple(fields.keys())
+
+        query = self.statements.get(
+            (table, 'insert', fieldnames),
+            self._build_insert,
+            table,
+            fieldnames
+        )
 
-        fieldnames = fields.keys()
+        return self.execute(query, fields)
 
-        query = query.format(
+    def _build_insert(self, table, fieldnames):
+        return 'INSERT INTO {} ({}) VALUES ({})'.format(
             table,
             ','.join(fieldnames),
             ','.join(':{}'.format(name) for name in fieldnames)
         )
 
-        return self.execute(query, fields)
-
     def update(self, table, fields, where_query='', where_args={}, **kwargs):
-        query = 'UPDATE {} SET {} WHERE {}'
-
         fieldnames = tuple(fields.keys())
 
         if where_query:
             fields.update(where_args)
+            query = self._build_update(table, fieldnames, where_query)
 
         else:
             fields.update({
                 'where_' + key: value for key, value in kwargs.items()
             })
+            wherenames = tuple(kwargs.keys())
+            query = self.statements.get(
+                (table, 'update', fieldnames, wherenames),
+                self._build_update,
+                table,
+                fieldnames,
+                '',
+                wherenames
+            )
+
+        return self.execute(query, fields)
+
+    def update_many(self, table, rows, *wherenames):
+        # rows are dicts of fields plus 'where_' prefixed values for each
+        # name in wherenames, e.g. update_many(table, rows, 'id')
+        if not rows:
+            return 0
+
+        fieldnames = tuple(
+            name for name in rows[0] if not name.startswith('where_')
+        )
+        query = self.statements.get(
+            (table, 'update', fieldnames, wherenames),
+            self._build_update,
+            table,
+            fieldnames,
+            '',
+            wherenames
+        )
+
+        return self.execute_many(query, rows)
+
+    def _build_update(self, table, fieldnames, where_query, wherenames=()):
+        if not where_query:
             where_query = ' AND '.join(
-                '{0} = :where_{0}'.format(name) for name in kwargs.keys()
+                '{0} = :where_{0}'.format(name) for name in wherenames
             )
 
-        query = query.format(
+        return 'UPDATE {} SET {} WHERE {}'.format(
             table,
             ','.join('{0} = :{0}'.format(name) for name in fieldnames),
             where_query
         )
 
-        return self.execute(query, fields)
-
 
 sys.modules[__name__] = Database()
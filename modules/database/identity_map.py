@@ -0,0 +1,197 @@
+import asyncio
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    current_task = asyncio.current_task
+
+except AttributeError:  # python < 3.7
+    current_task = asyncio.Task.current_task
+
+
+class IdentityMap:
+    """Keeps one instance per (model class, id) in each task's open scope"""
+
+    def __init__(self, maximum=10000):
+        self.maximum = maximum
+
+        self._scopes = []
+        self._tasks = {}
+        self._local = threading.local()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        scope = self.current()
+        return 0 if scope is None else len(scope.models)
+
+    @property
+    def active(self):
+        return self.current() is not None
+
+    def current(self):
+        scope = getattr(self._local, 'scope', None)
+        if scope is not None:
+            return scope
+
+        task = get_current_task()
+        if task is not None:
+            return self._tasks.get(task)
+
+        return None
+
+    @contextmanager
+    def scope(self):
+        scope = self.current()
+
+        with self._lock:
+            if scope is None:
+                scope = Scope()
+                self._scopes.append(scope)
+                self._own(scope)
+
+            scope.depth += 1
+
+        try:
+            yield self
+
+        finally:
+            with self._lock:
+                scope.depth -= 1
+
+                if not scope.depth:
+                    self._disown(scope)
+                    self._scopes.remove(scope)
+                    scope.models.clear()
+
+    def _own(self, scope):
+        task = get_current_task()
+
+        if task is None:
+            self._local.scope = scope
+
+        else:
+            scope.task = task
+            self._tasks[task] = scope
+
+    def _disown(self, scope):
+        if scope.task is None:
+            self._local.scope = None
+
+        else:
+            self._tasks.pop(scope.task, None)
+
+    def call_in(self, scope, func):
+        # runs func on this thread as if inside scope, for database.aio
+        previous = getattr(self._local, 'scope', None)
+        self._local.scope = scope
+
+        try:
+            return func()
+
+        finally:
+            self._local.scope = previous
+
+    def get(self, model_class, model_id):
+        scope = self.current()
+        if scope is None:
+            return None
+
+        key = (model_class, model_id)
+
+        with self._lock:
+            model = scope.models.get(key)
+
+            if model is not None:
+                scope.models.move_to_end(key)
+
+        return model
+
+    def add(self, model):
+        scope = self.current()
+        if scope is None or model.id is None:
+            return model
+
+        key = (type(model), model.id)
+
+        with self._lock:
+            scope.models[key] = model
+            scope.models.move_to_end(key)
+
+            while len(scope.models) > self.maximum:
+                scope.models.popitem(last=False)
+
+        return model
+
+    def get_all(self, model_class, model_id):
+        # the instances of a row in every open scope
+        key = (model_class, model_id)
+
+        with self._lock:
+            return [
+                scope.models[key] for scope in self._scopes
+                if key in scope.models
+            ]
+
+    def each(self, model_class):
+        with self._lock:
+            return [
+                model for scope in self._scopes
+                for key, model in scope.models.items()
+                if key[0] is model_class
+            ]
+
+    def discard(self, model_class, model_id):
+        # drops a row from every open scope, returning the instances dropped
+        key = (model_class, model_id)
+
+        with self._lock:
+            return [
+                scope.models.pop(key) for scope in self._scopes
+                if key in scope.models
+            ]
+
+    def discard_where(self, model_class, predicate):
+        with self._lock:
+            discarded = []
+
+            for scope in self._scopes:
+                keys = [
+                    key for key, model in scope.models.items()
+                    if key[0] is model_class and predicate(model)
+                ]
+                discarded += [scope.models.pop(key) for key in keys]
+
+            return discarded
+
+    def clear(self):
+        with self._lock:
+            for scope in self._scopes:
+                scope.models.clear()
+
+    def clear_current(self):
+        scope = self.current()
+        if scope is None:
+            return
+
+        with self._lock:
+            scope.models.clear()
+
+
+class Scope:
+    __slots__ = ('models', 'depth', 'task')
+
+    def __init__(self):
+        self.models = OrderedDict()
+        self.depth = 0
+        self.task = None
+
+
+def get_current_task():
+    # the task running on this thread's event loop, if there is one
+    try:
+        return current_task()
+
+    except RuntimeError:
+        return None
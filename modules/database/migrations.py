@@ -0,0 +1,413 @@
+import re
+import hashlib
+import logging
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+from collections import defaultdict
+
+INDEX_PATTERN = re.compile(
+    r'\s*CREATE\s+(?P<unique>UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+    r'(?P<name>\w+)\s+ON\s+\w+\s*\((?P<columns>.*)\)',
+    re.IGNORECASE | re.DOTALL
+)
+
+
+class Migrator:
+    """Brings every model table in line with its .sql file and fields"""
+
+    def __init__(self, database):
+        self.database = database
+
+        self._done = False
+        self._lock = threading.RLock()
+
+    def ensure(self):
+        if self._done:
+            return
+
+        with self._lock:
+            if self._done:
+                return
+
+            # set up front, as building the models below lands back here
+            self._done = True
+
+            try:
+                self.migrate(self.get_models())
+
+            except:
+                self._done = False
+                raise
+
+    def get_models(self):
+        from . import models
+
+        return [
+            getattr(models, name)(self.database.bot)
+            for name in dir(models)
+            if name[0].isupper()
+        ]
+
+    def migrate(self, models):
+        self.database.execute("""
+            CREATE TABLE IF NOT EXISTS
+                schema_version
+            (
+                name TEXT PRIMARY KEY NOT NULL,
+                version TEXT NOT NULL
+            )
+        """)
+
+        versions = {
+            row['name']: row['version']
+            for row in self.database.fetch_all(
+                'SELECT name, version FROM schema_version'
+            )
+        }
+
+        changed = [
+            (model, version)
+            for model, version in (
+                (model, self.get_version(model)) for model in models
+            )
+            if versions.get(model.table) != version
+        ]
+
+        if not changed:
+            return
+
+        models = {type(model).__name__: model for model in models}
+
+        # merging duplicate parents can duplicate their children, so parents
+        # get their unique indexes first
+        changed.sort(key=lambda change: len([
+            r for r in change[0].relations.values() if not r.many
+        ]))
+
+        with self.database.lock, self.foreign_keys_disabled(), \
+                self.database.transaction():
+            for model, version in changed:
+                self.migrate_table(model)
+
+            for model, version in changed:
+                self.ensure_indexes(model, models)
+
+                self.database.execute(
+                    'INSERT OR REPLACE INTO schema_version VALUES (?, ?)',
+                    (model.table, version),
+                    commit=False
+                )
+
+            self.remove_orphans()
+
+        self.database.identity_map.clear()
+        self.database.statements.clear()
+
+    @contextmanager
+    def foreign_keys_disabled(self):
+        # rebuilding drops tables, which would otherwise cascade to every
+        # child row; sqlite ignores this pragma inside a transaction
+        self.database.flush()
+        self.database.execute('PRAGMA foreign_keys = OFF')
+
+        try:
+            if self.database.fetch_value('PRAGMA foreign_keys'):
+                raise RuntimeError(
+                    'Tables can only be migrated outside of a transaction'
+                )
+
+            yield
+
+        finally:
+            self.database.execute('PRAGMA foreign_keys = ON')
+
+    def remove_orphans(self):
+        # rows whose parent went before foreign keys were declared; the
+        # cascade would have taken them, so they go now
+        while True:
+            orphans = defaultdict(list)
+            for row in self.database.fetch_all('PRAGMA foreign_key_check'):
+                orphans[row[0]].append(row[1])
+
+            if not orphans:
+                return
+
+            for table, rowids in orphans.items():
+                logging.warning('Removing {} orphaned {} rows'.format(
+                    len(rowids),
+                    table
+                ))
+
+                for i in range(0, len(rowids), 500):
+                    chunk = rowids[i:i + 500]
+                    self.database.execute(
+                        'DELETE FROM {} WHERE rowid IN ({})'.format(
+                            table,
+                            ','.join('?' * len(chunk))
+                        ),
+                        chunk,
+                        commit=False
+                    )
+
+    def get_version(self, model):
+        definition = '{}\n{}'.format(model.read_schema(), ','.join(
+            sorted(model.fields)
+        ))
+
+        return hashlib.sha1(definition.encode('utf-8')).hexdigest()
+
+    def migrate_table(self, model):
+        statements = self.split_statements(model.read_schema())
+        create_table = statements[0]
+        columns = self.get_columns(model.table)
+
+        if not columns:
+            logging.info('Creating table {}'.format(model.table))
+            self.execute_all(statements)
+            return
+
+        old_fields = set(columns) - {'id'}
+        new_fields = set(model.fields)
+
+        if old_fields < new_fields:
+            self.add_columns(model, create_table, new_fields - old_fields)
+
+            # added columns only go on the end, and anything else that
+            # changed (types, constraints, column order) still needs a rebuild
+            if not self.is_same_table(model.table, create_table):
+                self.rebuild_table(
+                    model,
+                    create_table,
+                    self.get_columns(model.table)
+                )
+
+        elif (old_fields != new_fields or
+                not self.is_same_table(model.table, create_table)):
+            self.rebuild_table(model, create_table, columns)
+
+    def split_statements(self, sql):
+        statements = []
+        current = ''
+
+        for piece in sql.split(';'):
+            current += piece + ';'
+
+            if sqlite3.complete_statement(current):
+                statements.append(current.strip())
+                current = ''
+
+        return [s for s in statements if s.strip(';').strip()]
+
+    def execute_all(self, statements, parameters=()):
+        for statement in statements:
+            self.database.execute(statement, parameters, commit=False)
+
+    def get_columns(self, table):
+        rows = self.database.fetch_all("pragma table_info('{}')".format(
+            table
+        ))
+
+        return [row['name'] for row in rows]
+
+    def get_column_definitions(self, create_table):
+        body = create_table[create_table.index('(') + 1:
+                            create_table.rindex(')')]
+
+        definitions = {}
+        depth = 0
+        current = ''
+
+        for char in body + ',':
+            depth += {'(': 1, ')': -1}.get(char, 0)
+
+            if char == ',' and not depth:
+                name = current.split()[0].strip('"`[]')
+                definitions[name] = current.strip()
+                current = ''
+
+            else:
+                current += char
+
+        return definitions
+
+    def add_columns(self, model, create_table, fields):
+        definitions = self.get_column_definitions(create_table)
+
+        for field in model.fields:
+            if field not in fields:
+                continue
+
+            logging.info('Adding column {}.{}'.format(model.table, field))
+
+            definition = definitions[field]
+            if 'DEFAULT' not in definition.upper():
+                definition += ' DEFAULT {}'.format(
+                    self.quote(model.fields[field])
+                )
+
+            self.database.execute(
+                'ALTER TABLE {} ADD COLUMN {}'.format(model.table, definition),
+                commit=False
+            )
+
+    def quote(self, value):
+        if value is None:
+            return 'NULL'
+
+        if isinstance(value, (bool, int, float)):
+            return str(int(value) if isinstance(value, bool) else value)
+
+        return "'{}'".format(str(value).replace("'", "''"))
+
+    def is_same_table(self, table, create_table):
+        existing = self.database.fetch_value(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+            table
+        )
+
+        return self.normalise(existing) == self.normalise(create_table)
+
+    def normalise(self, sql):
+        sql = re.sub(r'\s+', ' ', sql.replace('"', '')).strip().rstrip(';')
+        return re.sub(r'\s*([(),])\s*', r'\1', sql).lower()
+
+    def rebuild_table(self, model, create_table, columns):
+        logging.info('Rebuilding table {}'.format(model.table))
+
+        temp_table = '{}__new'.format(model.table)
+        kept = [c for c in columns if c == 'id' or c in model.fields]
+        added = [f for f in model.fields if f not in columns]
+
+        self.database.execute(re.sub(
+            r'^(\s*CREATE\s+TABLE\s+)' + re.escape(model.table) + r'\b',
+            lambda match: match.group(1) + temp_table,
+            create_table,
+            count=1,
+            flags=re.IGNORECASE
+        ), commit=False)
+
+        self.database.execute(
+            'INSERT INTO {} ({}) SELECT {} FROM {}'.format(
+                temp_table,
+                ','.join(kept + added),
+                ','.join(kept + ['?'] * len(added)),
+                model.table
+            ),
+            [model.fields[field] for field in added],
+            commit=False
+        )
+
+        self.execute_all((
+            'DROP TABLE {}'.format(model.table),
+            'ALTER TABLE {} RENAME TO {}'.format(temp_table, model.table),
+        ))
+
+    def ensure_indexes(self, model, models):
+        declared = {}
+        for statement in self.split_statements(model.read_schema())[1:]:
+            match = INDEX_PATTERN.match(statement)
+            if match:
+                declared[match.group('name')] = (statement, match)
+
+        existing = {
+            row['name']: row['sql'] for row in self.database.fetch_all(
+                """
+                    SELECT
+                        name,
+                        sql
+                    FROM
+                        sqlite_master
+                    WHERE
+                            type = 'index'
+                        AND
+                            tbl_name = ?
+                        AND
+                            sql IS NOT NULL
+                """,
+                model.table
+            )
+        }
+
+        for name, sql in list(existing.items()):
+            if (name not in declared or
+                    self.normalise(sql) != self.normalise(declared[name][0])):
+                self.database.execute(
+                    'DROP INDEX {}'.format(name),
+                    commit=False
+                )
+                del existing[name]
+
+        for name, (statement, match) in declared.items():
+            if name in existing:
+                continue
+
+            logging.info('Creating index {}'.format(name))
+
+            if match.group('unique'):
+                columns = [
+                    column.split()[0]
+                    for column in match.group('columns').split(',')
+                ]
+                self.merge_duplicates(model, columns, models)
+
+            self.database.execute(statement, commit=False)
+
+    def merge_duplicates(self, model, columns, models):
+        duplicates = self.database.fetch_all("""
+            SELECT
+                MIN(id) AS keep,
+                GROUP_CONCAT(id) AS ids
+            FROM
+                {}
+            GROUP BY
+                {}
+            HAVING
+                COUNT(1) > 1
+        """.format(model.table, ','.join(columns)))
+
+        children = [
+            (models[relation.model].table, relation.keys['id'])
+            for relation in model.relations.values()
+            if relation.many and list(relation.keys) == ['id']
+        ]
+
+        for row in duplicates:
+            ids = [int(i) for i in row['ids'].split(',')]
+            ids.remove(row['keep'])
+            placeholders = ','.join('?' * len(ids))
+
+            logging.warning('Merging duplicate {} rows {!r} into {}'.format(
+                model.table,
+                ids,
+                row['keep']
+            ))
+
+            for table, field in children:
+                # children that would now clash with one the kept row
+                # already has are duplicates themselves, so they go too
+                query = 'UPDATE OR IGNORE {0} SET {1} = ? WHERE {1} IN ({2})'
+                self.database.execute(
+                    query.format(table, field, placeholders),
+                    [row['keep']] + ids,
+                    commit=False
+                )
+                self.database.execute(
+                    'DELETE FROM {} WHERE {} IN ({})'.format(
+                        table,
+                        field,
+                        placeholders
+                    ),
+                    ids,
+                    commit=False
+                )
+
+            self.database.execute(
+                'DELETE FROM {} WHERE id IN ({})'.format(
+                    model.table,
+                    placeholders
+                ),
+                ids,
+                commit=False
+            )
@@ -0,0 +1,319 @@
+import math
+import threading
+
+
+class Mirror:
+    """Keeps whole copies of small, hot tables in memory"""
+
+    OPERATORS = ('eq', 'in')
+
+    def __init__(self, database):
+        self.database = database
+
+        self._rows = {}
+        self._indexes = {}
+        self._affinities = {}
+        self._journal = []
+        self._lock = threading.RLock()
+
+    def __contains__(self, model_class):
+        return model_class in self._rows
+
+    def load(self, model_classes):
+        with self.database.lock:
+            rows = {}
+            affinities = {}
+
+            for model_class in model_classes:
+                rows[model_class] = {
+                    row[0]: tuple(row)
+                    for row in self.database.fetch_all(
+                        'SELECT {} FROM {}'.format(
+                            ', '.join(model_class._columns),
+                            model_class._table
+                        )
+                    )
+                }
+                affinities[model_class] = self._get_affinities(model_class)
+
+            with self._lock:
+                self.clear()
+                self._rows.update(rows)
+                self._indexes.update((model_class, {}) for model_class in rows)
+                self._affinities.update(affinities)
+
+    def _get_affinities(self, model_class):
+        types = {
+            row[1]: row[2] for row in self.database.fetch_all(
+                "pragma table_info('{}')".format(model_class._table)
+            )
+        }
+
+        return {
+            column: get_affinity(types.get(column, ''))
+            for column in model_class._columns
+        }
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._indexes.clear()
+            self._affinities.clear()
+            self._journal.clear()
+
+    def select(self, model, groups, conditions, order_by, limit, offset):
+        # matching rows for a get_list_by() call, or None if it has to go to
+        # sqlite instead
+        model_class = type(model)
+
+        if (groups or model_class not in self._rows or
+                self.database.reading_snapshot):
+            return None
+
+        filters = []
+        for key, value in conditions.items():
+            field, _, operator = key.partition('__')
+            operator = operator or 'eq'
+
+            if operator not in self.OPERATORS:
+                return None
+
+            model._check_fields((field, ))
+            affinity = self._affinities[model_class][field]
+            filters.append((field, [
+                apply_affinity(affinity, value)
+                for value in ([value] if operator == 'eq' else value)
+            ]))
+
+        order = model._build_order_by(order_by) if order_by else ''
+
+        with self._lock:
+            rows = self._match(model_class, filters)
+
+        for term in reversed(order.split(', ') if order else []):
+            field, direction = term.split()
+            position = model_class._columns.index(field)
+
+            # sqlite puts NULL first in ascending order
+            rows.sort(
+                key=lambda row: (row[position] is not None, row[position]),
+                reverse=direction == 'DESC'
+            )
+
+        start = int(offset or 0)
+        if limit is None or int(limit) < 0:
+            return rows[start:]
+
+        return rows[start:start + int(limit)]
+
+    def _match(self, model_class, filters):
+        rows = self._rows[model_class]
+
+        if not filters:
+            return list(rows.values())
+
+        ids = None
+        for field, values in filters:
+            index = self._get_index(model_class, field)
+            found = set()
+
+            # NULL never equals anything in sqlite
+            for value in values:
+                if value is not None:
+                    found.update(index.get(value, ()))
+
+            ids = found if ids is None else ids & found
+
+            if not ids:
+                return []
+
+        return [rows[model_id] for model_id in ids]
+
+    def _get_index(self, model_class, field):
+        indexes = self._indexes[model_class]
+
+        try:
+            return indexes[field]
+
+        except KeyError:
+            index = indexes[field] = {}
+            position = model_class._columns.index(field)
+
+            for row in self._rows[model_class].values():
+                index.setdefault(row[position], set()).add(row[0])
+
+            return index
+
+    def insert(self, model):
+        if type(model) in self._rows:
+            self._reload(type(model), [model.id])
+
+    def update(self, model_class, model_ids):
+        rows = self._rows.get(model_class)
+        if rows is not None:
+            self._reload(model_class, [i for i in model_ids if i in rows])
+
+    def _reload(self, model_class, model_ids, chunk_size=500):
+        # sqlite may have stored something other than the value written,
+        # e.g. '0' becomes 0 in an integer column, so the rows are read back
+        for i in range(0, len(model_ids), chunk_size):
+            chunk = model_ids[i:i + chunk_size]
+            rows = {
+                row[0]: tuple(row)
+                for row in self.database.fetch_all(
+                    'SELECT {} FROM {} WHERE id IN ({})'.format(
+                        ', '.join(model_class._columns),
+                        model_class._table,
+                        ', '.join('?' * len(chunk))
+                    ),
+                    chunk
+                )
+            }
+
+            with self._lock:
+                for model_id in chunk:
+                    row = rows.get(model_id)
+                    self._put(
+                        model_class,
+                        model_id,
+                        None if row is None else row[1:],
+                        True
+                    )
+
+    def discard(self, model_class, model_ids):
+        if model_class not in self._rows:
+            return []
+
+        with self._lock:
+            return [
+                row for row in (
+                    self._put(model_class, model_id, None, True)
+                    for model_id in model_ids
+                ) if row is not None
+            ]
+
+    def discard_where(self, model_class, fields, keys):
+        # drops every row whose values for fields are one of keys, returning
+        # the rows dropped
+        rows = self._rows.get(model_class)
+        if rows is None:
+            return []
+
+        positions = [model_class._columns.index(field) for field in fields]
+        affinities = [self._affinities[model_class][field] for field in fields]
+        keys = {
+            tuple(map(apply_affinity, affinities, key)) for key in keys
+        }
+        with self._lock:
+            model_ids = [
+                row[0] for row in rows.values()
+                if tuple(row[position] for position in positions) in keys
+            ]
+
+            return self.discard(model_class, model_ids)
+
+    def _put(self, model_class, model_id, values, journal):
+        # values of None removes the row; returns the row it replaced
+        rows = self._rows[model_class]
+        old = rows.pop(model_id, None)
+
+        if values is not None:
+            rows[model_id] = (model_id, ) + tuple(values)
+
+        for field, index in self._indexes[model_class].items():
+            position = model_class._columns.index(field)
+
+            if old is not None:
+                ids = index.get(old[position])
+                ids.discard(model_id)
+
+                if not ids:
+                    del index[old[position]]
+
+            if values is not None:
+                value = rows[model_id][position]
+                index.setdefault(value, set()).add(model_id)
+
+        if journal and self.database.transaction_depth:
+            self._journal.append((model_class, model_id, old))
+
+        return old
+
+    def mark(self):
+        return len(self._journal)
+
+    def commit(self):
+        del self._journal[:]
+
+    def rollback(self, mark=0):
+        # puts back every row changed since mark, newest change first
+        with self._lock:
+            while len(self._journal) > mark:
+                model_class, model_id, old = self._journal.pop()
+
+                if model_class in self._rows:
+                    self._put(
+                        model_class,
+                        model_id,
+                        None if old is None else old[1:],
+                        False
+                    )
+
+
+def get_affinity(declared_type):
+    # sqlite's rules for the affinity a column's declared type gives it
+    declared_type = declared_type.upper()
+
+    if 'INT' in declared_type:
+        return 'INTEGER'
+
+    if any(name in declared_type for name in ('CHAR', 'CLOB', 'TEXT')):
+        return 'TEXT'
+
+    if 'BLOB' in declared_type or not declared_type:
+        return 'BLOB'
+
+    if any(name in declared_type for name in ('REAL', 'FLOA', 'DOUB')):
+        return 'REAL'
+
+    return 'NUMERIC'
+
+
+def apply_affinity(affinity, value):
+    # a value as sqlite would compare it with a column of this affinity:
+    # numbers against text columns as text, and well-formed numeric text
+    # against numeric columns as a number
+    if isinstance(value, bool):
+        value = int(value)
+
+    if affinity == 'TEXT' and isinstance(value, (int, float)):
+        return str(value)
+
+    if affinity in ('INTEGER', 'REAL', 'NUMERIC') and isinstance(value, str):
+        return to_number(value)
+
+    return value
+
+
+def to_number(text):
+    # python also takes digits split up by underscores; sqlite doesn't
+    if '_' in text:
+        return text
+
+    try:
+        return int(text)
+
+    except ValueError:
+        pass
+
+    try:
+        number = float(text)
+
+    except ValueError:
+        return text
+
+    # python accepts spellings of these that sqlite doesn't
+    if math.isinf(number) or math.isnan(number):
+        return text
+
+    return number
@@ -0,0 +1,113 @@
+OPERATORS = {
+    'eq': '{} = ?',
+    'ne': '{} != ?',
+    'lt': '{} < ?',
+    'lte': '{} <= ?',
+    'gt': '{} > ?',
+    'gte': '{} >= ?',
+    'like': '{} LIKE ?',
+    'range': '{} BETWEEN ? AND ?',
+}
+
+
+class Or(object):
+    """Matches rows that meet any one of its groups"""
+
+    def __init__(self, *groups, **conditions):
+        # Or({'admin': True, 'server_did': did}, blacklisted=True)
+        self.groups = list(groups)
+        self.groups += [{field: value} for field, value in conditions.items()]
+
+
+def compile_filters(groups, conditions):
+    """Splits filters into a hashable shape and a flat list of parameters"""
+    return _compile_group(list(groups) + [conditions], 'AND')
+
+
+def _compile_group(groups, joiner):
+    shapes = []
+    parameters = []
+
+    for group in groups:
+        if isinstance(group, Or):
+            shape, values = _compile_group(group.groups, 'OR')
+
+        elif isinstance(group, dict):
+            shape, values = _compile_conditions(group)
+
+        else:
+            raise TypeError('Filters must be dicts or Or, not {}'.format(
+                type(group).__name__
+            ))
+
+        if shape[1]:
+            shapes.append(shape)
+            parameters += values
+
+    return (joiner, tuple(shapes)), parameters
+
+
+def _compile_conditions(conditions):
+    shapes = []
+    parameters = []
+
+    for key, value in conditions.items():
+        field, _, operator = key.partition('__')
+        operator = operator or 'eq'
+
+        if operator == 'in':
+            value = list(value)
+            shapes.append((field, operator, len(value)))
+            parameters += value
+
+        elif operator == 'range':
+            low, high = value
+            shapes.append((field, operator, 2))
+            parameters += [low, high]
+
+        elif operator == 'isnull':
+            shapes.append((field, operator, bool(value)))
+
+        else:
+            shapes.append((field, operator, 1))
+            parameters.append(value)
+
+    return ('AND', tuple(shapes)), parameters
+
+
+def build_where(shape, check_field):
+    """Turns a shape from compile_filters() into a WHERE clause"""
+    joiner, parts = shape
+
+    return ' {} '.format(joiner).join(
+        _build_part(part, joiner, check_field) for part in parts
+    )
+
+
+def _build_part(part, joiner, check_field):
+    if len(part) == 3:
+        return _build_condition(part, check_field)
+
+    # only a group joined differently from its parent needs brackets
+    where = build_where(part, check_field)
+    if part[0] == joiner or len(part[1]) == 1:
+        return where
+
+    return '({})'.format(where)
+
+
+def _build_condition(condition, check_field):
+    field, operator, count = condition
+    check_field(field)
+
+    if operator == 'in':
+        return '{} IN ({})'.format(field, ','.join('?' * count))
+
+    if operator == 'isnull':
+        return '{} IS {}NULL'.format(field, '' if count else 'NOT ')
+
+    try:
+        return OPERATORS[operator].format(field)
+
+    except KeyError:
+        raise AttributeError('Unknown filter "{}__{}"'.format(field, operator))
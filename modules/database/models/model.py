@@ -1,34 +1,130 @@
 import inspect
-import logging
 
 from types import MappingProxyType
+from itertools import islice
+from collections import defaultdict, OrderedDict
+from discord.utils import CachedSlotProperty
 from modules import database
+from .filters import compile_filters, build_where
+from ..changes import Change
 
 
-class Model(object):
-    # These attributes are tracked at the class-level, not the object-level
-    _table_exists = False
-    _table_up_to_date = False
+class Relation(object):
+    def __init__(self, model, keys, many=True, cascade=False):
+        # cascade marks relations the schema deletes with ON DELETE CASCADE
+        self.model = model
+        self.keys = keys
+        self.many = many
+        self.cascade = cascade
+
+
+class ModelMeta(type):
+    """Works out each model's table, fields and relations once per class"""
+
+    # every model class by name, for following relations backwards
+    models = {}
+
+    def __new__(mcs, name, bases, namespace):
+        if mcs.is_model(bases):
+            namespace['__slots__'] = mcs.get_slots(namespace)
+
+        return super().__new__(mcs, name, bases, namespace)
+
+    def __init__(cls, name, bases, namespace):
+        super().__init__(name, bases, namespace)
+
+        if not type(cls).is_model(bases):
+            return
+
+        fields = get_field_defaults(cls.define_fields(None))
+
+        cls._table = cls.define_table(None)
+        cls._fields = MappingProxyType(fields)
+        cls._relations = MappingProxyType(cls.define_relations(None))
+        cls._columns = ('id', ) + tuple(fields)
+        cls._bool_fields = frozenset(
+            field for field, default in fields.items()
+            if type(default) is bool
+        )
+
+        type(cls).models[name] = cls
+
+    @staticmethod
+    def is_model(bases):
+        return any(isinstance(base, ModelMeta) for base in bases)
+
+    @staticmethod
+    def get_slots(namespace):
+        slots = list(namespace.get('__slots__', ()))
+
+        if 'define_fields' in namespace:
+            fields = namespace['define_fields'](None)
+            slots += list(get_field_defaults(fields))
+
+        if 'define_relations' in namespace:
+            relations = namespace['define_relations'](None)
+            slots += ['_' + name for name in relations]
+
+        slots += [
+            value.name for value in namespace.values()
+            if isinstance(value, CachedSlotProperty)
+        ]
+
+        return tuple(OrderedDict.fromkeys(slots))
+
+
+def get_field_defaults(fields):
+    if not isinstance(fields, dict):
+        fields = {field: None for field in fields}
+
+    return fields
+
+
+class Model(object, metaclass=ModelMeta):
+    __slots__ = ('bot', '_id', '_dirty', '_deleted')
 
     def __init__(self, bot):
         self.bot = bot
 
         self._init_attributes()
-        self._build_table_if_necessary()
-        self._update_table_if_necessary()
+        database.migrations.ensure()
+
+    def __setattr__(self, name, value):
+        try:
+            changed = name in self._fields and getattr(self, name) != value
+
+        except AttributeError:
+            changed = False
+
+        super().__setattr__(name, value)
+
+        if changed:
+            self._dirty.add(name)
 
     def __getattr__(self, name):
         if name.startswith('get_list_by_'):
-            return lambda value: self.get_list_by(**{name[12:]: value})
+            return self._add_finder(name, 'get_list_by', name[12:])
 
         if name.startswith('get_by_'):
-            return lambda value: self.get_by(**{name[7:]: value})
+            return self._add_finder(name, 'get_by', name[7:])
 
         raise AttributeError("'{}' object has no attribute '{}'".format(
             type(self).__name__,
             name
         ))
 
+    def _add_finder(self, name, method, field):
+        # defined on the class, so each finder is only ever built once
+        self._check_fields((field, ))
+
+        def finder(self, value):
+            return getattr(self, method)(**{field: value})
+
+        finder.__name__ = name
+        setattr(type(self), name, finder)
+
+        return getattr(self, name)
+
     def __str__(self):
         objfmt = '{name} `({id!r})`: {fields}'
         fieldfmt = '`{f}` = `{v!r}`'
@@ -53,121 +149,123 @@ class Model(object):
     def fields(self):
         return self._fields
 
-    def _init_attributes(self):
-        self._init_id()
-        self._init_table()
-        self._init_fields()
+    @property
+    def relations(self):
+        return self._relations
+
+    @property
+    def dirty_fields(self):
+        return frozenset(self._dirty)
+
+    @property
+    def deleted(self):
+        return self._deleted
 
-    def _init_id(self):
+    def _init_attributes(self):
+        self._dirty = set()
         self._id = None
+        self._deleted = False
 
-    def _init_table(self):
-        self._table = self.define_table()
+        for field, default in self.fields.items():
+            object.__setattr__(self, field, default)
 
     def define_table(self):
         raise NotImplementedError('Child model must override define_table()')
 
-    def _init_fields(self):
-        fields = self.define_fields()
-
-        if not isinstance(fields, dict):
-            fields = {field: None for field in fields}
-
-        for field, default in fields.items():
-            setattr(self, field, default)
-
-        self._fields = MappingProxyType(fields)
-
     def define_fields(self):
         raise NotImplementedError('Child model must override define_fields()')
 
-    def _build_table_if_necessary(self):
-        if not self.__class__._table_exists:
-            if not self.has_table():
-                self.build_table()
-
-            self.__class__._table_exists = True
+    def define_relations(self):
+        # {name: Relation(model_name, {local_field: remote_field}, many)}
+        # the loaded value of each relation is cached in the '_name' slot
+        return {}
 
-    def has_table(self):
-        query = """
-            SELECT
-                COUNT(1)
-            FROM
-                sqlite_master
-            WHERE
-                    type = 'table'
-                AND
-                    name = ?
-        """
-
-        return int(database.fetch_value(query, self.table)) > 0
-
-    def build_table(self):
+    def read_schema(self):
         with open(inspect.getfile(type(self))[:-3] + '.sql', 'r') as file:
-            database.execute(file.read(), script=True)
-
-    def _update_table_if_necessary(self):
-        if not self.__class__._table_up_to_date:
-            if self._needs_new_columns():
-                self._update_table()
-
-            self.__class__._table_up_to_date = True
-
-    def _needs_new_columns(self):
-        query = """
-            pragma table_info('{}')
-        """.format(
-            self.table
+            return file.read()
+
+    def get_list_by(self, *groups, prefetch=(), order_by='id ASC', limit=None,
+                    offset=None, **kwargs):
+        # kwargs are `field=value` or `field__operator=value`, and each of
+        # groups is an Or; see filters.compile_filters() for the operators
+        data = database.mirror.select(
+            self,
+            groups,
+            kwargs,
+            order_by,
+            limit,
+            offset
         )
 
-        fields = [f['name'] for f in database.fetch_all(query)]
-        fields.remove('id')
+        if data is None:
+            query, parameters = self._get_select(
+                groups,
+                kwargs,
+                order_by,
+                limit,
+                offset
+            )
+            data = database.fetch_all(query, parameters)
+
+        models = [self._build_from_fields(fields) for fields in data]
+
+        return self.prefetch(models, *prefetch)
+
+    def iter_list_by(self, *groups, prefetch=(), order_by='id ASC',
+                     limit=None, offset=None, chunk_size=500, **kwargs):
+        # streams from the cursor, so only one chunk of models (and whatever
+        # they prefetch) is built at a time
+        rows = database.mirror.select(
+            self,
+            groups,
+            kwargs,
+            order_by,
+            limit,
+            offset
+        )
 
-        return set(fields) != set(self.fields.keys())
+        if rows is None:
+            query, parameters = self._get_select(
+                groups,
+                kwargs,
+                order_by,
+                limit,
+                offset
+            )
+            chunks = database.fetch_chunks(query, parameters, chunk_size)
 
-    def _update_table(self):
-        old_data = self._get_old_data()
+        else:
+            chunks = (
+                rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)
+            )
 
-        self._delete_table()
-        self.build_table()
+        for data in chunks:
+            models = [self._build_from_fields(fields) for fields in data]
 
-        for row in old_data:
-            fields = dict(self.fields)
-            fields.update(row)
+            yield from self.prefetch(models, *prefetch)
 
-            database.insert(self.table, fields)
+    def _get_select(self, groups, conditions, order_by, limit, offset):
+        shape, parameters = compile_filters(groups, conditions)
+        paged = limit is not None or offset is not None
 
-    def _get_old_data(self):
-        query = """
-            SELECT
-                *
-            FROM
-                {}
-            ORDER BY
-                id ASC
-        """.format(
-            self.table
+        query = database.statements.get(
+            (self.__class__, 'select', shape, order_by, paged),
+            self._build_select,
+            shape,
+            order_by,
+            paged
         )
 
-        return database.fetch_all(query)
+        if paged:
+            parameters.append(-1 if limit is None else int(limit))
+            parameters.append(int(offset or 0))
 
-    def _delete_table(self):
-        query = """
-            DROP TABLE
-                {}
-        """.format(
-            self.table
-        )
-
-        database.execute(query, commit=False)
-
-    def get_list_by(self, **kwargs):
-        if not kwargs:
-            return self.get_all()
+        return query, parameters
 
+    def _check_fields(self, fieldnames):
         all_fields = list(self.fields) + ['id']
 
-        for field in kwargs:
+        for field in fieldnames:
             if field not in all_fields:
                 raise AttributeError(
                     'Field "{}" not found in model "{}"'.format(
@@ -176,78 +274,493 @@ class Model(object):
                     )
                 )
 
+    def _build_select(self, shape, order_by, paged):
+        where = build_where(shape, lambda field: self._check_fields((field, )))
+
         query = """
             SELECT
-                *
+                {}
             FROM
                 {}
+        """.format(', '.join(self._columns), self.table)
+
+        if where:
+            query += """
             WHERE
                 {}
-        """.format(
-            self.table,
-            ' AND '.join('{0} = :{0}'.format(name) for name in kwargs)
+            """.format(where)
+
+        if order_by:
+            query += """
+            ORDER BY
+                {}
+            """.format(self._build_order_by(order_by))
+
+        if paged:
+            query += """
+            LIMIT ? OFFSET ?
+            """
+
+        return query
+
+    def _build_order_by(self, order_by):
+        # 'field', 'field DESC', 'a ASC, b DESC' or a tuple of those
+        if isinstance(order_by, str):
+            order_by = order_by.split(',')
+
+        terms = []
+        for term in order_by:
+            parts = term.split()
+            direction = parts[1].upper() if len(parts) == 2 else 'ASC'
+
+            if not 1 <= len(parts) <= 2 or direction not in ('ASC', 'DESC'):
+                raise ValueError('Invalid order_by "{}" for model "{}"'.format(
+                    term.strip(),
+                    type(self).__name__
+                ))
+
+            self._check_fields(parts[:1])
+            terms.append('{} {}'.format(parts[0], direction))
+
+        return ', '.join(terms)
+
+    def _build_from_fields(self, row):
+        # rows come from selects listing self._columns, in that order
+        mapped = database.identity_map.get(self.__class__, row[0])
+        if mapped is not None:
+            return mapped
+
+        return database.identity_map.add(self._new_from_row(row))
+
+    def _new_from_row(self, row):
+        # __init__ and dirty tracking are skipped, as every field is set here
+        cls = self.__class__
+        model = cls.__new__(cls)
+        assign = object.__setattr__
+        assign(model, 'bot', self.bot)
+        assign(model, '_id', row[0])
+        assign(model, '_dirty', set())
+        assign(model, '_deleted', False)
+
+        bool_fields = cls._bool_fields
+        for field, value in zip(cls._columns[1:], islice(row, 1, None)):
+            if field in bool_fields:
+                value = bool(value)
+
+            assign(model, field, value)
+
+        return model
+
+    def get_all(self, order_by='id ASC', prefetch=(), limit=None,
+                offset=None):
+        return self.get_list_by(
+            prefetch=prefetch,
+            order_by=order_by,
+            limit=limit,
+            offset=offset
         )
-        data = database.fetch_all(query, kwargs)
 
-        return [self._build_from_fields(fields) for fields in data]
+    def iter_all(self, order_by='id ASC', prefetch=(), limit=None,
+                 offset=None, chunk_size=500):
+        return self.iter_list_by(
+            prefetch=prefetch,
+            order_by=order_by,
+            limit=limit,
+            offset=offset,
+            chunk_size=chunk_size
+        )
 
-    def _build_from_fields(self, fields):
-        fields = dict(fields)
+    def prefetch(self, models, *paths):
+        # paths are relation names, with dots for relations of relations:
+        # prefetch(streamers, 'streamer_channels.streamer_messages')
+        nested = defaultdict(list)
+        for path in paths:
+            name, _, rest = path.partition('.')
+            nested[name] += [rest] if rest else []
 
-        model = self.__class__(self.bot)
-        model._id = fields.pop('id')
-        for field in model.fields:
-            value = fields.pop(field)
+        for name, rest in nested.items():
+            related = self._load_relation(models, name)
 
-            if type(getattr(model, field)) is bool:
-                value = bool(value)
+            if rest and related:
+                related[0].prefetch(related, *rest)
 
-            setattr(model, field, value)
+        return models
 
-        if fields:
-            logging.warning('{} has extra fields in the database: {!r}'.format(
-                type(self).__name__,
-                fields
-            ))
+    def _load_relation(self, models, name):
+        try:
+            relation = self.relations[name]
 
-        return model
+        except KeyError:
+            raise AttributeError(
+                'Relation "{}" not found in model "{}"'.format(
+                    name,
+                    type(self).__name__
+                )
+            )
 
-    def get_all(self, order_by='id ASC'):
-        query = """
-            SELECT
-                *
-            FROM
-                {}
-            ORDER BY
-                {}
-        """.format(self.table, order_by)
-        data = database.fetch_all(query)
+        local_fields = tuple(relation.keys.keys())
+        remote_fields = tuple(relation.keys.values())
+
+        # narrow the query on the first key, then match the rest in python
+        values = {getattr(model, local_fields[0]) for model in models}
+        target = database.get_initialised_model(relation.model)
 
-        return [self._build_from_fields(fields) for fields in data]
+        grouped = defaultdict(list)
+        for related in target._get_list_where_in(remote_fields[0], values):
+            key = tuple(getattr(related, field) for field in remote_fields)
+            grouped[key].append(related)
 
-    def get_by(self, **kwargs):
-        models = self.get_list_by(**kwargs)
+        for model in models:
+            key = tuple(getattr(model, field) for field in local_fields)
+            found = grouped.get(key, [])
+
+            if relation.many:
+                found = list(found)
+
+            else:
+                found = found[0] if found else None
+
+            setattr(model, '_' + name, found)
+
+        return [related for group in grouped.values() for related in group]
+
+    def _get_list_where_in(self, field, values, chunk_size=500):
+        # chunked to stay under sqlite's limit on bound parameters
+        values = list(values)
+        models = []
+
+        for i in range(0, len(values), chunk_size):
+            models += self.get_list_by(
+                **{field + '__in': values[i:i + chunk_size]}
+            )
+
+        return models
+
+    def get_by(self, *groups, **kwargs):
+        if not groups and list(kwargs) == ['id']:
+            mapped = database.identity_map.get(self.__class__, kwargs['id'])
+            if mapped is not None:
+                return mapped
+
+        models = self.get_list_by(*groups, limit=1, **kwargs)
         return models[0] if models else None
 
     def save(self):
-        fields = {field: getattr(self, field) for field in self.fields}
+        self._save_row()
 
+    def _save_row(self):
+        # a deleted model has no id, but mustn't be inserted again as new
+        if self._deleted:
+            return
+
+        # the lock keeps the mirror in step with the row it's written with
+        with database.lock:
+            self._write_row()
+
+    def _write_row(self):
         if self.id is None:
+            fields = {field: getattr(self, field) for field in self.fields}
+
             self._id = database.insert(self.table, fields)
+            self._dirty.clear()
+            database.identity_map.add(self)
+            database.mirror.insert(self)
+            database.changes.publish([self._get_change('insert', fields)])
+
+        elif self._dirty:
+            # only the changed columns, in a stable order for the cache
+            fields = {
+                field: getattr(self, field)
+                for field in self.fields
+                if field in self._dirty
+            }
+
+            database.update(self.table, dict(fields), id=self.id)
+            database.mirror.update(self.__class__, [self.id])
+            database.changes.publish([self._get_change('update', fields)])
+            self._sync_mapped_instance(fields)
+
+    def _get_change(self, operation, fields=()):
+        return Change(
+            type(self).__name__,
+            self.id,
+            operation,
+            frozenset(fields)
+        )
 
-        else:
-            database.update(self.table, fields, id=self.id)
+    def _sync_mapped_instance(self, fields):
+        # other instances of this row may already be handed out, in this
+        # scope or another task's, so bring them in line rather than letting
+        # them go stale
+        self._dirty.difference_update(fields)
+
+        if database.identity_map.get(self.__class__, self.id) is None:
+            database.identity_map.add(self)
+
+        for mapped in database.identity_map.get_all(self.__class__, self.id):
+            if mapped is self:
+                continue
+
+            for field in fields:
+                setattr(mapped, field, getattr(self, field))
+
+            mapped._dirty.difference_update(fields)
+
+    async def save_async(self):
+        return await database.aio.run(self.save)
+
+    def save_many(self, models):
+        # saves rows only, without any cascading a model's save() may do
+        models = [model for model in models if not model._deleted]
+
+        # rows are grouped by which columns changed, one executemany each
+        changed = defaultdict(list)
+        for model in models:
+            if model.id is not None and model._dirty:
+                fieldnames = tuple(f for f in self.fields if f in model._dirty)
+                changed[fieldnames].append(model)
+
+        with database.transaction():
+            for model in models:
+                if model.id is None:
+                    model._save_row()
+
+            for fieldnames, group in changed.items():
+                rows = []
+                for model in group:
+                    row = {f: getattr(model, f) for f in fieldnames}
+                    row['where_id'] = model.id
+                    rows.append(row)
+
+                database.update_many(self.table, rows, 'id')
+                database.mirror.update(
+                    self.__class__,
+                    [model.id for model in group]
+                )
+
+                database.changes.publish([
+                    model._get_change('update', fieldnames) for model in group
+                ])
+
+        for fieldnames, group in changed.items():
+            for model in group:
+                model._sync_mapped_instance(fieldnames)
 
     def delete(self):
         if not self.id:
             return
 
-        query = """
+        query = database.statements.get(
+            (self.__class__, 'delete'),
+            self._build_delete
+        )
+
+        with database.lock:
+            changes = self._get_delete_changes([self])
+            database.execute(query, self.id)
+            self._forget_deleted([self])
+            database.changes.publish(changes)
+
+    def _build_delete(self):
+        return """
             DELETE FROM
                 {}
             WHERE
                 id = ?
         """.format(self.table)
 
-        database.execute(query, self.id)
-        self._id = None
+    def delete_many(self, models, chunk_size=500):
+        # deletes rows without calling each model's delete(), though the
+        # schema's own cascades still apply
+        models = [model for model in models if model.id]
+
+        with database.transaction():
+            changes = self._get_delete_changes(models)
+
+            for i in range(0, len(models), chunk_size):
+                chunk = models[i:i + chunk_size]
+                query = database.statements.get(
+                    (self.__class__, 'delete_in', len(chunk)),
+                    self._build_delete_in,
+                    len(chunk)
+                )
+
+                database.execute(query, [model.id for model in chunk])
+
+            self._forget_deleted(models)
+            database.changes.publish(changes)
+
+    def _build_delete_in(self, count):
+        return """
+            DELETE FROM
+                {}
+            WHERE
+                id IN ({})
+        """.format(self.table, ','.join('?' * count))
+
+    def delete_where(self, **kwargs):
+        if not kwargs:
+            raise AttributeError('delete_where() needs at least one field')
+
+        fieldnames = tuple(kwargs)
+        query = database.statements.get(
+            (self.__class__, 'delete_where', fieldnames),
+            self._build_delete_where,
+            fieldnames
+        )
+
+        with database.lock:
+            changes = []
+            if database.changes.wants(self._get_cascade_names()):
+                changes = self._get_delete_changes(self.get_list_by(**kwargs))
+
+            database.execute(query, kwargs)
+
+            deleted = self._discard_where(
+                fieldnames,
+                {tuple(kwargs[field] for field in fieldnames)}
+            )
+            self._forget_deleted(deleted)
+            database.changes.publish(changes)
+
+    def _build_delete_where(self, fieldnames):
+        self._check_fields(fieldnames)
+
+        return """
+            DELETE FROM
+                {}
+            WHERE
+                {}
+        """.format(
+            self.table,
+            ' AND '.join('{0} = :{0}'.format(name) for name in fieldnames)
+        )
+
+    def _get_delete_changes(self, models):
+        # read before deleting, as the rows the schema cascades to can only be
+        # found while they're still there. Cascades are only followed as far
+        # as some subscriber wants changes to a model along them
+        if not models or not database.changes.wants(self._get_cascade_names()):
+            return []
+
+        changes = [model._get_change('delete') for model in models]
+
+        for name, relation in self.relations.items():
+            if not relation.cascade:
+                continue
+
+            target = ModelMeta.models[relation.model]
+            if not database.changes.wants(target._get_cascade_names()):
+                continue
+
+            related = self._load_relation(models, name)
+
+            if related:
+                changes += related[0]._get_delete_changes(related)
+
+        return changes
+
+    @classmethod
+    def _get_cascade_names(cls):
+        # this model and every model that deleting it cascades to
+        names = {cls.__name__}
+        pending = [cls]
+
+        while pending:
+            for relation in pending.pop()._relations.values():
+                if relation.cascade and relation.model not in names:
+                    names.add(relation.model)
+                    pending.append(ModelMeta.models[relation.model])
+
+        return names
+
+    def _discard_where(self, fields, keys):
+        # drops rows whose values for fields are one of keys from the
+        # identity map and the mirror, returning a model for each
+        cls = self.__class__
+        discarded = database.identity_map.discard_where(
+            cls,
+            lambda model: tuple(
+                getattr(model, field) for field in fields
+            ) in keys
+        )
+        ids = {model.id for model in discarded}
+
+        for row in database.mirror.discard_where(cls, fields, keys):
+            if row[0] not in ids:
+                discarded.append(self._new_from_row(row))
+
+        return discarded
+
+    def _forget_deleted(self, models):
+        # the rows are gone, so neither these nor any mapped or mirrored rows
+        # the schema cascaded to should look saved any more
+        self._forget_cascaded(models)
+        database.mirror.discard(self.__class__, [m.id for m in models])
+
+        ids = {model.id for model in models if model.id is not None}
+        cls = self.__class__
+
+        for model in models:
+            for mapped in database.identity_map.discard(cls, model.id):
+                mapped._id = None
+                mapped._deleted = True
+
+            model._id = None
+            model._deleted = True
+
+        self._prune_relations(ids)
+
+    def _prune_relations(self, ids):
+        # mapped models that had loaded these rows through a relation would
+        # go on handing them out, so they're taken out of those lists. The
+        # lists are replaced rather than changed, as a task may be part way
+        # through one
+        name = type(self).__name__
+
+        for cls in ModelMeta.models.values():
+            for relation_name, relation in cls._relations.items():
+                if relation.model != name or not relation.many:
+                    continue
+
+                slot = '_' + relation_name
+
+                for model in database.identity_map.each(cls):
+                    related = getattr(model, slot, None)
+                    if related is None:
+                        continue
+
+                    kept = [
+                        r for r in related
+                        if not r._deleted and r.id not in ids
+                    ]
+
+                    if len(kept) != len(related):
+                        object.__setattr__(model, slot, kept)
+
+    def _forget_cascaded(self, models):
+        for name, relation in self.relations.items():
+            if not relation.cascade:
+                continue
+
+            local_fields = tuple(relation.keys.keys())
+            remote_fields = tuple(relation.keys.values())
+            keys = {
+                tuple(getattr(model, field) for field in local_fields)
+                for model in models
+            }
+
+            target = database.get_model_prototype(relation.model)
+            cascaded = target._discard_where(remote_fields, keys)
+
+            # along with whatever the deleted models had already loaded,
+            # which may not be mapped anywhere
+            for model in models:
+                for related in getattr(model, '_' + name, None) or []:
+                    if not any(related is other for other in cascaded):
+                        cascaded.append(related)
+
+            target._forget_deleted(cascaded)
+
+    async def delete_async(self, *args, **kwargs):
+        return await database.aio.run(self.delete, *args, **kwargs)
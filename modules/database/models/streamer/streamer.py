@@ -1,5 +1,5 @@
 from discord.utils import cached_slot_property
-from ..model import Model
+from ..model import Model, Relation
 from modules import database
 
 
@@ -21,22 +21,38 @@ class Streamer(Model):
             'username': None,
         }
 
+    def define_relations(self):
+        return {
+            'streamer_channels': Relation(
+                'StreamerChannel',
+                {'id': 'streamer_id'},
+                cascade=True
+            ),
+            'streamer_messages': Relation(
+                'StreamerMessage',
+                {'id': 'streamer_id'},
+                cascade=True
+            ),
+        }
+
     def save(self):
-        super().save()
+        with database.transaction():
+            super().save()
 
-        for channel in self.streamer_channels:
-            channel.streamer_id = self.id
-            channel.save()
+            for channel in self.streamer_channels:
+                channel.streamer_id = self.id
 
-        for message in self.streamer_messages:
-            message.streamer_id = self.id
-            message.save()
+            for message in self.streamer_messages:
+                message.streamer_id = self.id
 
-    def delete(self):
-        for channel in self.streamer_channels:
-            channel.delete()
+            database.get_StreamerChannel().save_many(self.streamer_channels)
+            database.get_StreamerMessage().save_many(self.streamer_messages)
 
-        for message in self.streamer_messages:
-            message.delete()
+    def delete(self, delete_discord_messages=True):
+        # channels and messages go with the row through ON DELETE CASCADE,
+        # so the messages are only read beforehand to clear them from discord
+        messages = self.streamer_messages if delete_discord_messages else []
 
         super().delete()
+
+        database.get_StreamerMessage().delete_discord_messages(messages)
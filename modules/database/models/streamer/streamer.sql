@@ -6,7 +6,7 @@ CREATE TABLE
     username TEXT NOT NULL
 );
 
-CREATE INDEX
+CREATE UNIQUE INDEX
     streamers_username
 ON
     streamers
@@ -1,6 +1,6 @@
 from discord.utils import cached_slot_property
 from discord import NotFound, Forbidden
-from ..model import Model
+from ..model import Model, Relation
 from modules import database
 
 
@@ -43,8 +43,24 @@ class StreamerChannel(Model):
             'template': '',
         }
 
-    def delete(self):
-        for message in self.streamer_messages:
-            message.delete()
+    def define_relations(self):
+        return {
+            'streamer': Relation(
+                'Streamer',
+                {'streamer_id': 'id'},
+                many=False
+            ),
+            'streamer_messages': Relation(
+                'StreamerMessage',
+                {'streamer_id': 'streamer_id', 'channel_did': 'channel_did'},
+                cascade=True
+            ),
+        }
+
+    def delete(self, delete_discord_messages=True):
+        # messages go with the row through ON DELETE CASCADE
+        messages = self.streamer_messages if delete_discord_messages else []
 
         super().delete()
+
+        database.get_StreamerMessage().delete_discord_messages(messages)
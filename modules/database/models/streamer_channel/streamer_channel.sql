@@ -2,15 +2,17 @@ CREATE TABLE
     streamer_channels
 (
     id INTEGER PRIMARY KEY ASC AUTOINCREMENT,
-    streamer_id INTEGER NOT NULL,
+    streamer_id INTEGER NOT NULL
+        REFERENCES streamers (id) ON DELETE CASCADE,
     channel_did TEXT NOT NULL,
     template TEXT NOT NULL
 );
 
-CREATE INDEX
-    streamer_channels_streamer_id
+CREATE UNIQUE INDEX
+    streamer_channels_streamer_id_channel_did
 ON
     streamer_channels
     (
-        streamer_id
+        streamer_id,
+        channel_did
     );
@@ -1,17 +1,22 @@
+import asyncio
+
 from discord.utils import cached_slot_property
 from discord import NotFound, Forbidden
-from ..model import Model
+from ..model import Model, Relation
 from modules import database
 
 
 class StreamerMessage(Model):
+    __slots__ = ('_message', )
+
     @cached_slot_property('_streamer')
     def streamer(self):
         return database.get_Streamer_by_id(self.streamer_id)
 
     @property
     def channel(self):
-        return self.streamer_channel.channel
+        # not through streamer_channel, which may already have been deleted
+        return self.bot.get_channel(self.channel_did)
 
     @cached_slot_property('_streamer_channel')
     def streamer_channel(self):
@@ -31,12 +36,56 @@ class StreamerMessage(Model):
             'message_did',
         )
 
+    def define_relations(self):
+        return {
+            'streamer': Relation(
+                'Streamer',
+                {'streamer_id': 'id'},
+                many=False
+            ),
+            'streamer_channel': Relation(
+                'StreamerChannel',
+                {'streamer_id': 'streamer_id', 'channel_did': 'channel_did'},
+                many=False
+            ),
+        }
+
     def delete(self, delete_discord_message=True):
         if delete_discord_message:
-            self.bot.loop.create_task(self.delete_message())
+            self.schedule_delete_message()
 
         super().delete()
 
+    def delete_many(self, models, delete_discord_messages=True):
+        models = list(models)
+
+        if delete_discord_messages:
+            self.delete_discord_messages(models)
+
+        super().delete_many(models)
+
+    def schedule_delete_message(self):
+        self.delete_discord_messages([self])
+
+    def delete_discord_messages(self, models):
+        # for rows removed in bulk, including by a cascade; may be called
+        # from the database worker thread
+        models = list(models)
+
+        if models:
+            asyncio.run_coroutine_threadsafe(
+                self._delete_messages(models),
+                self.bot.loop
+            )
+
+    async def _delete_messages(self, models):
+        for model in models:
+            try:
+                await model.delete_message()
+
+            except (NotFound, Forbidden):
+                pass
+
     async def delete_message(self):
         message = await self.get_message()
         if message:
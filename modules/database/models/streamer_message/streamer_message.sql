@@ -2,15 +2,20 @@ CREATE TABLE
     streamer_messages
 (
     id INTEGER PRIMARY KEY ASC AUTOINCREMENT,
-    streamer_id INTEGER NOT NULL,
+    streamer_id INTEGER NOT NULL
+        REFERENCES streamers (id) ON DELETE CASCADE,
     channel_did TEXT NOT NULL,
-    message_did TEXT NOT NULL
+    message_did TEXT NOT NULL,
+    FOREIGN KEY (streamer_id, channel_did)
+        REFERENCES streamer_channels (streamer_id, channel_did)
+        ON DELETE CASCADE
 );
 
 CREATE INDEX
-    streamer_messages_streamer_id
+    streamer_messages_streamer_id_channel_did
 ON
     streamer_messages
     (
-        streamer_id
+        streamer_id,
+        channel_did
     );
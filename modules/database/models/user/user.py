@@ -1,12 +1,14 @@
 import discord
 
 from discord.utils import cached_slot_property
-from ..model import Model
+from ..model import Model, Relation
 from modules import database
 from modules import UserLevel
 
 
 class User(Model):
+    __slots__ = ('_user', )
+
     @cached_slot_property('_user_servers')
     def user_servers(self):
         return database.get_UserServer_list_by_user_id(self.id)
@@ -29,6 +31,15 @@ class User(Model):
             'blacklisted': False,
         }
 
+    def define_relations(self):
+        return {
+            'user_servers': Relation(
+                'UserServer',
+                {'id': 'user_id'},
+                cascade=True
+            ),
+        }
+
     def is_admin(self, server):
         for user_server in self.user_servers:
             if user_server.server == server:
@@ -52,14 +63,10 @@ class User(Model):
         return UserLevel.get(discord.Object(self.user_did), channel)
 
     def save(self):
-        super().save()
-
-        for server in self.user_servers:
-            server.user_id = self.id
-            server.save()
+        with database.transaction():
+            super().save()
 
-    def delete(self):
-        for server in self.user_servers:
-            server.delete()
+            for server in self.user_servers:
+                server.user_id = self.id
 
-        super().delete()
+            database.get_UserServer().save_many(self.user_servers)
@@ -7,7 +7,7 @@ CREATE TABLE
     blacklisted INTEGER NOT NULL
 );
 
-CREATE INDEX
+CREATE UNIQUE INDEX
     users_user_did
 ON
     users
@@ -1,6 +1,6 @@
 from discord.utils import cached_slot_property
 from discord import NotFound, Forbidden
-from ..model import Model
+from ..model import Model, Relation
 from modules import database
 
 
@@ -27,3 +27,8 @@ class UserServer(Model):
             'admin': False,
             'blacklisted': False,
         }
+
+    def define_relations(self):
+        return {
+            'user': Relation('User', {'user_id': 'id'}, many=False),
+        }
@@ -2,16 +2,18 @@ CREATE TABLE
     user_servers
 (
     id INTEGER PRIMARY KEY ASC AUTOINCREMENT,
-    user_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL
+        REFERENCES users (id) ON DELETE CASCADE,
     server_did TEXT NOT NULL,
     admin INTEGER NOT NULL,
     blacklisted INTEGER NOT NULL
 );
 
-CREATE INDEX
-    user_servers_user_id
+CREATE UNIQUE INDEX
+    user_servers_user_id_server_did
 ON
     user_servers
     (
-        user_id
+        user_id,
+        server_did
     );
@@ -0,0 +1,151 @@
+import os
+import sys
+import logging
+import threading
+
+from collections import deque
+
+MODEL_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'models',
+    'model.py'
+)
+
+
+class QueryStats:
+    """Counts and times every statement the database runs"""
+
+    def __init__(self, slow_threshold=0.1, samples=1000):
+        self.slow_threshold = slow_threshold
+        self.samples = samples
+
+        self._templates = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, query, seconds, rows=0):
+        try:
+            template = self._templates[query]
+
+        except KeyError:
+            template = self._templates[query] = ' '.join(query.split())
+
+        with self._lock:
+            try:
+                stats = self._stats[template]
+
+            except KeyError:
+                stats = self._stats[template] = TemplateStats(self.samples)
+
+            stats.add(seconds, rows)
+
+        if self.slow_threshold and seconds >= self.slow_threshold:
+            logging.warning('Slow query ({:.1f}ms) from {}: {}'.format(
+                seconds * 1000,
+                get_caller(),
+                template
+            ))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def report(self, order_by='total', limit=10):
+        # order_by is any key of TemplateStats.summary(), highest first
+        with self._lock:
+            summaries = [
+                dict(stats.summary(), template=template)
+                for template, stats in self._stats.items()
+            ]
+
+        summaries.sort(key=lambda summary: summary[order_by], reverse=True)
+
+        return summaries[:limit]
+
+    def format_report(self, order_by='total', limit=10, width=100):
+        summaries = self.report(order_by, limit)
+
+        if not summaries:
+            return 'No queries recorded'
+
+        return '\n'.join(
+            ('{count}x {total:.1f}ms total, p50 {p50:.2f}ms p95 {p95:.2f}ms'
+             ' p99 {p99:.2f}ms, {rows} rows\n    {short}').format(
+                short=shorten(summary['template'], width),
+                **summary
+            )
+            for summary in summaries
+        )
+
+
+class TemplateStats:
+    __slots__ = ('count', 'seconds', 'rows', 'latencies')
+
+    def __init__(self, samples):
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.latencies = deque(maxlen=samples)
+
+    def add(self, seconds, rows):
+        self.count += 1
+        self.seconds += seconds
+        self.rows += max(rows, 0)
+        self.latencies.append(seconds)
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+
+        return {
+            'count': self.count,
+            'total': self.seconds * 1000,
+            'p50': percentile(latencies, 50) * 1000,
+            'p95': percentile(latencies, 95) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'rows': self.rows,
+        }
+
+
+def percentile(ordered, percent):
+    if not ordered:
+        return 0.0
+
+    index = int(round((len(ordered) - 1) * percent / 100))
+    return ordered[index]
+
+
+def shorten(text, width):
+    return text if len(text) <= width else text[:width - 3] + '...'
+
+
+def get_caller():
+    # the first model method on the stack, plus where it was called from if
+    # that's outside the generic model code
+    from .models.model import Model
+
+    frame = sys._getframe(1)
+    method = None
+
+    while frame:
+        filename = os.path.abspath(frame.f_code.co_filename)
+
+        if method is None:
+            instance = frame.f_locals.get('self')
+
+            if isinstance(instance, Model):
+                method = '{}.{}'.format(
+                    type(instance).__name__,
+                    frame.f_code.co_name
+                )
+
+        elif filename != MODEL_FILE:
+            return '{} via {}:{} ({})'.format(
+                method,
+                os.path.relpath(filename),
+                frame.f_lineno,
+                frame.f_code.co_name
+            )
+
+        frame = frame.f_back
+
+    return method or 'outside any model'
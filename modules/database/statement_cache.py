@@ -0,0 +1,33 @@
+class StatementCache:
+    """Remembers generated SQL by a key describing its shape"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+        self._statements = {}
+
+    def __len__(self):
+        return len(self._statements)
+
+    def get(self, key, builder, *args):
+        # builder only runs on a miss, so it's where validation belongs
+        try:
+            statement = self._statements[key]
+            self.hits += 1
+
+        except KeyError:
+            statement = self._statements[key] = builder(*args)
+            self.misses += 1
+
+        return statement
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'statements': len(self._statements),
+        }
+
+    def clear(self):
+        self._statements.clear()
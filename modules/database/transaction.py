@@ -0,0 +1,149 @@
+import asyncio
+
+from .identity_map import get_current_task
+
+
+class Transaction:
+    """Batches every write made inside it into a single commit"""
+
+    def __init__(self, database):
+        self.database = database
+
+        self._owner = False
+        self._savepoint = None
+        self._mirror_mark = 0
+        self._changes_mark = 0
+
+    def __enter__(self):
+        self.database.lock.acquire()
+
+        try:
+            self._begin()
+
+        except:
+            self.database.lock.release()
+            raise
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self._end(exc_type is None)
+
+        finally:
+            self.database.lock.release()
+
+    async def __aenter__(self):
+        database = self.database
+        task = get_current_task()
+
+        # the connection lock can't be held across awaits, so the task owns
+        # database.aio until the transaction ends instead; nested inside the
+        # task's own transaction, it already has the lock
+        self._owner = database.transaction_task is not task
+        if self._owner:
+            await database.async_transaction_lock.acquire()
+            database.transaction_task = task
+
+        try:
+            await database.aio.run(self._locked, self._begin)
+
+        except:
+            self._release()
+            raise
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            await self.database.aio.run(
+                self._locked,
+                self._end,
+                exc_type is None
+            )
+
+        finally:
+            self._release()
+
+    def _release(self):
+        if self._owner:
+            self.database.transaction_task = None
+            self.database.async_transaction_lock.release()
+
+    def _locked(self, func, *args):
+        with self.database.lock:
+            return func(*args)
+
+    def _begin(self):
+        database = self.database
+
+        if database.transaction_depth:
+            self._savepoint = 'transaction_{}'.format(
+                database.transaction_depth
+            )
+            database.execute(
+                'SAVEPOINT {}'.format(self._savepoint),
+                commit=False
+            )
+            self._mirror_mark = database.mirror.mark()
+            self._changes_mark = database.changes.mark()
+
+        else:
+            # writes deferred by group commit go out on their own first
+            database.flush()
+            database.execute('BEGIN', commit=False)
+
+        database.transaction_depth += 1
+
+    def _end(self, success):
+        database = self.database
+        database.transaction_depth -= 1
+
+        if self._savepoint:
+            if not success:
+                database.execute(
+                    'ROLLBACK TO {}'.format(self._savepoint),
+                    commit=False
+                )
+                database.mirror.rollback(self._mirror_mark)
+                database.changes.rollback(self._changes_mark)
+
+            database.execute(
+                'RELEASE {}'.format(self._savepoint),
+                commit=False
+            )
+
+        elif success:
+            database.commit()
+
+        else:
+            database.rollback()
+
+
+class GroupCommit:
+    """Defers commits from plain writes and flushes them every `interval`"""
+
+    def __init__(self, database, interval):
+        self.database = database
+        self.interval = interval
+
+        self._owner = None
+        self._task = None
+
+    async def __aenter__(self):
+        self._owner = get_current_task()
+        self.database.group_commit_tasks.append(self._owner)
+        self._task = self.database.aio.loop.create_task(self._flush_loop())
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._task.cancel()
+        self.database.group_commit_tasks.remove(self._owner)
+
+        await self.database.aio.run(self.database.flush)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.database.aio.run(self.database.flush)
@@ -0,0 +1,150 @@
+import math
+import time
+import random
+
+
+class PollScheduler:
+    """Decides which streamers to check on each pass of the poll loop"""
+
+    def __init__(self, live_interval=60, recent_interval=15,
+                 dormant_interval=120, recent_window=3600, budget=60,
+                 batch_size=100, jitter=0.1, max_delay=5, retry_interval=15,
+                 max_retry_interval=600):
+        self.live_interval = live_interval
+        self.recent_interval = recent_interval
+        self.dormant_interval = dormant_interval
+        self.recent_window = recent_window
+        self.budget = budget
+        self.batch_size = batch_size
+        self.jitter = jitter
+        self.max_delay = max_delay
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+
+        self.streamers = {}
+        self.allowance = budget
+        self.updated = time.perf_counter()
+
+    def add(self, streamer_ids):
+        # new streamers are due straight away
+        now = time.perf_counter()
+
+        for streamer_id in streamer_ids:
+            self.streamers.setdefault(streamer_id, StreamerSchedule(now))
+
+    def discard(self, streamer_ids):
+        for streamer_id in streamer_ids:
+            self.streamers.pop(streamer_id, None)
+
+    async def on_changes(self, changes):
+        # subscribed to database.changes for streamers
+        for change in changes:
+            if change.operation == 'insert':
+                self.add([change.id])
+
+            elif change.operation == 'delete':
+                self.discard([change.id])
+
+    def take_due(self):
+        now = self.refill()
+        due = [
+            (streamer_id, schedule)
+            for streamer_id, schedule in self.streamers.items()
+            if schedule.next_check <= now
+        ]
+
+        due.sort(
+            key=lambda item: item[1].get_lateness(now),
+            reverse=True
+        )
+
+        # spend() can leave the allowance below nothing
+        due = due[:max(0, int(self.allowance)) * self.batch_size]
+        self.allowance -= math.ceil(len(due) / self.batch_size)
+
+        # checked() moves these on to their tier's interval; any it doesn't
+        # hear about are retried later, backing off while checks keep failing
+        for streamer_id, schedule in due:
+            schedule.retry_interval = min(
+                self.max_retry_interval,
+                schedule.retry_interval * 2 if schedule.retry_interval
+                else self.retry_interval
+            )
+            schedule.next_check = now + self.get_jittered(
+                schedule.retry_interval
+            )
+
+        return [streamer_id for streamer_id, schedule in due]
+
+    def spend(self, requests):
+        # a poll that sent fewer requests than planned gets them back
+        self.allowance = min(self.budget, self.allowance - requests)
+
+    def refill(self):
+        now = time.perf_counter()
+        self.allowance = min(
+            self.budget,
+            self.allowance + (now - self.updated) * self.budget / 60
+        )
+        self.updated = now
+
+        return now
+
+    def checked(self, streamer_id, live):
+        schedule = self.streamers.get(streamer_id)
+        if schedule is None:
+            return
+
+        now = time.perf_counter()
+
+        if live:
+            schedule.last_live = now
+            interval = self.live_interval
+
+        elif (schedule.last_live is not None and
+                now - schedule.last_live < self.recent_window):
+            interval = self.recent_interval
+
+        else:
+            interval = self.dormant_interval
+
+        schedule.interval = interval
+        schedule.retry_interval = None
+        schedule.next_check = now + self.get_jittered(interval)
+
+    def get_jittered(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def get_delay(self):
+        # seconds until the next streamer is due, or until the budget
+        # allows another request, within 1 and max_delay
+        now = self.refill()
+        delay = self.max_delay
+
+        if self.streamers:
+            next_check = min(s.next_check for s in self.streamers.values())
+            delay = min(delay, next_check - now)
+
+        if self.allowance < 1:
+            delay = max(delay, (1 - self.allowance) * 60 / self.budget)
+
+        return min(max(delay, 1), self.max_delay)
+
+
+class StreamerSchedule:
+    __slots__ = ('next_check', 'interval', 'retry_interval', 'last_live')
+
+    def __init__(self, next_check):
+        self.next_check = next_check
+        self.interval = None
+        self.retry_interval = None
+        self.last_live = None
+
+    def get_lateness(self, now):
+        # unchecked streamers haven't had a tier worked out yet, so they
+        # come before everything else until their checks start failing
+        interval = self.interval or self.retry_interval
+        if interval is None:
+            return math.inf
+
+        return (now - self.next_check) / interval
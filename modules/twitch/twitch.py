@@ -1,4 +1,6 @@
+import math
 import time
+import random
 import logging
 import asyncio
 import discord
@@ -6,33 +8,96 @@ import aiohttp
 import settings
 
 from string import Template
-from collections import defaultdict
+from sqlite3 import IntegrityError
+from collections import deque
 from concurrent.futures import CancelledError, TimeoutError
 from discord import NotFound, Forbidden
 from modules import database
 from utils import escape
+from .scheduler import PollScheduler
 
 
 class Twitch:
     def __init__(self, bot):
         self.bot = bot
 
-        self.api = Api(settings.twitch_client_id)
-        self.counter = Counter(maximum=20)
+        self.api = Api(
+            settings.twitch_client_id,
+            rate=settings.twitch_requests_per_minute / 60,
+            burst=settings.twitch_request_burst,
+            concurrency=settings.twitch_concurrent_requests,
+            hedge=settings.twitch_hedge_requests
+        )
+        self.offline = GracePeriod(settings.twitch_offline_grace)
+        self.scheduler = PollScheduler(
+            live_interval=settings.twitch_live_interval,
+            recent_interval=settings.twitch_recent_interval,
+            dormant_interval=settings.twitch_dormant_interval,
+            recent_window=settings.twitch_recent_window,
+            budget=settings.twitch_poll_budget,
+            batch_size=self.api.batch_size
+        )
 
         bot.loop.create_task(self.loop())
 
     async def loop(self):
         await self.bot.wait_until_ready()
 
-        while not self.bot.is_closed:
-            streamers = database.get_Streamer_list()
+        # streamers added or removed later are picked up from the changes
+        database.changes.subscribe(
+            self.scheduler.on_changes,
+            models=('Streamer', )
+        )
 
-            if streamers:
-                await self.insulate(self.do_streamer_alerts, streamers)
+        try:
+            streamers = await database.aio.get_Streamer_list()
+            self.scheduler.add(streamer.id for streamer in streamers)
 
-            else:
-                await asyncio.sleep(10)
+            while not self.bot.is_closed:
+                await self.poll()
+                await asyncio.sleep(self.scheduler.get_delay())
+
+        finally:
+            database.changes.unsubscribe(self.scheduler.on_changes)
+            self.api.close()
+
+    async def poll(self):
+        streamer_ids = self.scheduler.take_due()
+        if not streamer_ids:
+            return
+
+        requests = self.api.requests
+
+        async with database.group_commit():
+            with database.scope():
+                streamers = await database.aio.run(
+                    self.get_streamers,
+                    streamer_ids
+                )
+
+                if streamers:
+                    await self.insulate(self.do_streamer_alerts, streamers)
+
+        # take_due() only allowed for one get_streams request per batch, so
+        # id lookups, retries and hedged copies are paid for here
+        self.scheduler.spend(
+            self.api.requests - requests -
+            math.ceil(len(streamer_ids) / self.api.batch_size)
+        )
+
+    def get_streamers(self, streamer_ids, chunk_size=500):
+        streamers = []
+
+        for i in range(0, len(streamer_ids), chunk_size):
+            streamers += database.get_Streamer().get_list_by(
+                id__in=streamer_ids[i:i + chunk_size],
+                prefetch=(
+                    'streamer_channels.streamer_messages',
+                    'streamer_messages',
+                )
+            )
+
+        return streamers
 
     async def insulate(self, func, *args, **kwargs):
         try:
@@ -42,7 +107,10 @@ class Twitch:
             logging.warning((
                 'Error in Twitch.loop() when fetching {0.response.url}: {0!s}'
             ).format(ex))
-            await asyncio.sleep(60)
+
+            # the api's bucket is already waiting out a rate limit
+            if ex.response.status != 429:
+                await asyncio.sleep(60)
 
         except (aiohttp.ClientError, ConnectionResetError, TimeoutError) as ex:
             logging.warning('{} in Twitch.loop(): {!s}'.format(
@@ -61,12 +129,19 @@ class Twitch:
     async def do_streamer_alerts(self, streamers):
         await self.update_ids(streamers)
 
+        # streamers still without an id had their lookup fail (or were just
+        # deleted for not existing), so they stay due for the next pass
+        streamers = [s for s in streamers if s.twitch_id and not s.deleted]
         ids = [streamer.twitch_id for streamer in streamers]
         streamer_data = await self.api.get_streams(ids)
 
         for streamer in streamers:
             if not streamer.streamer_channels:
-                streamer.delete()
+                await streamer.delete_async()
+                continue
+
+            # left out when its batch failed, so it's tried again next time
+            if streamer.twitch_id not in streamer_data:
                 continue
 
             data = streamer_data[streamer.twitch_id]
@@ -77,6 +152,8 @@ class Twitch:
             else:
                 await self.handle_not_streaming(streamer)
 
+            self.scheduler.checked(streamer.id, bool(data))
+
     async def update_ids(self, streamers):
         streamers = [s for s in streamers if not s.twitch_id]
         usernames = [s.username for s in streamers]
@@ -84,15 +161,18 @@ class Twitch:
         user_data = await self.api.get_users(usernames)
 
         for streamer in streamers:
+            if streamer.username not in user_data:
+                continue
+
             if user_data[streamer.username] is None:
-                streamer.delete()
+                await streamer.delete_async()
                 continue
 
             streamer.twitch_id = str(user_data[streamer.username]['_id'])
-            streamer.save()
+            await streamer.save_async()
 
     async def handle_streaming(self, streamer, twitch_data):
-        self.counter.reset(streamer.username)
+        self.offline.reset(streamer.username)
 
         for streamer_channel in streamer.streamer_channels:
             template = streamer_channel.template or (
@@ -120,7 +200,11 @@ class Twitch:
                 return await self.send_message(streamer_channel, text)
 
             for streamer_message in streamer_channel.streamer_messages:
-                await self.update_message(streamer_message, text)
+                await self.update_message(
+                    streamer_channel,
+                    streamer_message,
+                    text
+                )
 
         except (NotFound, Forbidden):
             pass
@@ -141,39 +225,79 @@ class Twitch:
 
         streamer = streamer_channel.streamer
         streamer.streamer_messages.append(streamer_message)
-        streamer.save()
 
-    async def update_message(self, streamer_message, text):
+        try:
+            await streamer.save_async()
+
+        except IntegrityError:
+            # the alert was removed while the message was being sent, so
+            # there's nothing left for the message to belong to
+            if streamer_message in streamer.streamer_messages:
+                streamer.streamer_messages.remove(streamer_message)
+
+            await self.bot.delete_message(message)
+
+    async def update_message(self, streamer_channel, streamer_message, text):
         message = await streamer_message.get_message()
         if not message:
-            return await self.replace_message(streamer_message, text)
+            return await self.replace_message(
+                streamer_channel,
+                streamer_message,
+                text
+            )
 
         if message.content != text:
             return await self.bot.edit_message(message, text)
 
-    async def replace_message(self, streamer_message, text):
-        streamer_message.delete()
-        return await self.send_message(
-            streamer_message.streamer_channel,
-            text
-        )
+    async def replace_message(self, streamer_channel, streamer_message, text):
+        # not streamer_message.streamer_channel, which isn't prefetched and
+        # would be read from sqlite on the loop
+        await streamer_message.delete_async()
+        return await self.send_message(streamer_channel, text)
 
     async def handle_not_streaming(self, streamer):
         if (streamer.streamer_messages and
-                self.counter.click(streamer.username)):
+                self.offline.expired(streamer.username)):
             for streamer_message in streamer.streamer_messages:
-                streamer_message.delete()
+                await streamer_message.delete_async()
 
 
 class Api:
-    def __init__(self, client_id, batch_size=100, timeout_delay=1):
+    """Client for the parts of the Twitch api the bot polls"""
+
+    transient_errors = (aiohttp.ClientError, ConnectionResetError,
+                        TimeoutError)
+
+    def __init__(self, client_id, batch_size=100, rate=1, burst=1,
+                 concurrency=1, connections=10, keepalive_timeout=60,
+                 connect_timeout=5, request_timeout=10, retries=2,
+                 retry_delay=1, throttle_retries=3, throttle_delay=5,
+                 hedge=False, hedge_percentile=95, hedge_samples=20):
         self.url_root = 'https://api.twitch.tv/kraken/'
         self.headers = {
             'Accept': 'application/vnd.twitchtv.v5+json',
             'Client-ID': client_id,
         }
-        self.timeout_delay = timeout_delay
         self.batch_size = batch_size
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.throttle_retries = throttle_retries
+        self.throttle_delay = throttle_delay
+
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_samples = hedge_samples
+        self.latencies = deque(maxlen=200)
+        self.requests = 0
+
+        self.connections = connections
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.session = None
+        self._semaphore = None
 
         self.url_users = self.url_root + (
             'users'
@@ -187,81 +311,335 @@ class Api:
             '&channel={}'
         )
 
-        self.last_timeout = time.perf_counter() - timeout_delay
-
     async def get_users(self, usernames):
+        # usernames in a batch that failed are left out altogether
         responses = await self.get_responses(self.url_users, usernames)
 
-        data = {username: None for username in usernames}
-        for response in responses:
+        data = {}
+        for pieces, response in responses:
+            data.update((username, None) for username in pieces)
+
             for user in response.get('users', []):
                 data[user['name']] = user
 
         return data
 
     async def get_streams(self, uids):
+        # as with get_users(), uids in a failed batch are left out
         responses = await self.get_responses(self.url_streams, uids)
 
-        data = {uid: None for uid in uids}
-        for response in responses:
+        data = {}
+        for pieces, response in responses:
+            data.update((uid, None) for uid in pieces)
+
             for stream in response.get('streams', []):
                 data[str(stream['channel']['_id'])] = stream
 
         return data
 
     async def get_responses(self, url, pieces):
+        # batches go out together, as fast as the bucket and the concurrency
+        # limit allow, and are collected as (pieces, response) in the order
+        # they finish. Failed batches are logged and skipped, unless every
+        # batch failed, which is raised as the api being unavailable
+        futures = [
+            asyncio.ensure_future(self.get_responses_batch(
+                url,
+                pieces[i:i + self.batch_size]
+            ))
+            for i in range(0, len(pieces), self.batch_size)
+        ]
+
         responses = []
-        for i in range(0, len(pieces), self.batch_size):
-            pieces_batch = pieces[i:i + self.batch_size]
-            responses.append(await self.get_responses_batch(url, pieces_batch))
+        errors = []
+        try:
+            for future in asyncio.as_completed(futures):
+                try:
+                    responses.append(await future)
+
+                except self.transient_errors + (discord.HTTPException, ) as ex:
+                    errors.append(ex)
+
+        finally:
+            for future in futures:
+                future.cancel()
+
+        if errors and not responses:
+            raise errors[0]
+
+        for ex in errors:
+            logging.warning('{} fetching a Twitch api batch: {!s}'.format(
+                type(ex).__name__,
+                ex
+            ))
 
         return responses
 
     async def get_responses_batch(self, url, pieces):
         if not pieces:
-            return {}
+            return pieces, {}
 
         url = url.format(','.join(pieces))
         response = await self.do_query(url)
 
-        return response
+        return pieces, response
 
     async def do_query(self, url):
-        await self.timeout()
+        # errors that may pass are retried after a jittered backoff, and a
+        # throttled request once the bucket has waited out the limit
+        failures = 0
+        throttles = 0
+
+        while True:
+            try:
+                result, data = await self.do_attempt(url)
+
+                if 200 <= result.status < 300:
+                    return data
+
+                error = discord.HTTPException(
+                    result,
+                    'Error fetching twitch api'
+                )
+
+            except self.transient_errors as ex:
+                result, error = None, ex
+
+            if result is not None and result.status == 429:
+                throttles += 1
+                if throttles > self.throttle_retries:
+                    raise error
+
+                logging.info('Twitch api rate limited, retry {} of {}'.format(
+                    throttles,
+                    self.throttle_retries
+                ))
+                continue
+
+            if result is not None and result.status < 500:
+                raise error
+
+            failures += 1
+            if failures > self.retries:
+                raise error
+
+            await asyncio.sleep(self.get_backoff(failures))
+
+    def get_backoff(self, failures):
+        # doubles with each failure, jittered so retries don't line up
+        delay = self.retry_delay * 2 ** (failures - 1)
+        return delay * random.uniform(0.5, 1.5)
 
-        with aiohttp.ClientSession() as session:
+    async def do_attempt(self, url):
+        hedge_after = self.get_hedge_delay()
+        if hedge_after is None:
+            return await self.send(url)
+
+        sent = asyncio.Future()
+        copies = [asyncio.ensure_future(self.send(url, sent))]
+
+        try:
+            # the hedge delay is a network latency, so it's timed from when
+            # the first copy went out rather than while it queued for the
+            # semaphore or a token
+            await asyncio.wait(
+                [copies[0], sent],
+                return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if not copies[0].done():
+                await asyncio.wait(copies, timeout=hedge_after)
+
+            if copies[0].done():
+                return copies[0].result()
+
+            copies.append(asyncio.ensure_future(self.send(url)))
+            pending = set(copies)
+
+            # the first copy to succeed wins; an error only counts once
+            # every copy has failed
+            while True:
+                done, pending = await asyncio.wait(
+                    pending,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+
+                if not pending:
+                    return future.result()  # raises the last copy's error
+
+        finally:
+            for future in copies:
+                future.cancel()
+
+    def get_hedge_delay(self):
+        if not self.hedge or len(self.latencies) < self.hedge_samples:
+            return None
+
+        latencies = sorted(self.latencies)
+        index = (len(latencies) - 1) * self.hedge_percentile // 100
+
+        return latencies[index]
+
+    async def send(self, url, sent=None):
+        async with self.semaphore:
+            await self.bucket.acquire()
+            self.requests += 1
+
+            if sent is not None and not sent.done():
+                sent.set_result(None)
+
+            start = time.perf_counter()
+            try:
+                return await self.do_request(url)
+
+            finally:
+                # hedged copies that lost are timed as well, or the slow
+                # requests would drop out of the percentile
+                self.latencies.append(time.perf_counter() - start)
+
+    async def do_request(self, url):
+        session = self.get_session()
+
+        # covers the whole request, including reading the body
+        with aiohttp.Timeout(self.request_timeout):
             async with session.get(url, headers=self.headers) as result:
+                self.read_rate_limit(result)
+
                 if not 200 <= result.status < 300:
-                    raise discord.HTTPException(
-                        result,
-                        'Error fetching twitch api'
-                    )
+                    return result, None
+
+                return result, await result.json(encoding='utf-8')
 
-                return await result.json(encoding='utf-8')
+    def read_rate_limit(self, result):
+        # Ratelimit-Reset is a unix time, Retry-After a number of seconds
+        headers = result.headers
+        reset = None
 
-    async def timeout(self):
-        time_since = time.perf_counter() - self.last_timeout
-        time_until = self.timeout_delay - time_since
-        wait_time = max(0, time_until)
+        try:
+            remaining = int(headers['Ratelimit-Remaining'])
+            reset = float(headers['Ratelimit-Reset']) - time.time()
+
+        except (KeyError, ValueError):
+            pass
 
-        await asyncio.sleep(wait_time)
+        else:
+            self.bucket.limit(remaining, reset)
 
-        self.last_timeout = time.perf_counter()
+        if result.status == 429:
+            try:
+                delay = float(headers['Retry-After'])
+
+            except (KeyError, ValueError):
+                delay = reset if reset is not None else self.throttle_delay
+
+            self.bucket.pause(delay)
+
+    @property
+    def semaphore(self):
+        # created on first use so it belongs to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        return self._semaphore
+
+    def get_session(self):
+        # one session for the life of the bot, so connections to the api are
+        # kept alive and reused between polls instead of reconnecting
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.connections,
+                use_dns_cache=True,
+                keepalive_timeout=self.keepalive_timeout,
+                conn_timeout=self.connect_timeout
+            )
+            self.session = aiohttp.ClientSession(connector=connector)
+
+        return self.session
+
+    def close(self):
+        if self.session is not None and not self.session.closed:
+            self.session.close()
+
+        self.session = None
+
+
+class TokenBucket:
+    """Paces requests to an average rate while allowing short bursts"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+
+        self.tokens = capacity
+        self.updated = time.perf_counter()
+        self.paused_until = 0
+
+    def refill(self):
+        now = time.perf_counter()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    async def acquire(self):
+        self.refill()
+        self.tokens -= 1
+
+        delay = -self.tokens / self.rate
+        try:
+            while True:
+                # a pause can start while this caller is already waiting
+                delay = max(delay, self.paused_until - time.perf_counter())
+                if delay <= 0:
+                    return
+
+                await asyncio.sleep(delay)
+                delay = 0
+
+        except asyncio.CancelledError:
+            # the token was never used, so the next caller gets it
+            self.tokens = min(self.capacity, self.tokens + 1)
+            raise
+
+    def limit(self, remaining, seconds):
+        # spend what the server says is left evenly over its window
+        self.refill()
+        self.tokens = min(self.tokens, remaining)
+
+        if remaining < 1:
+            self.pause(seconds)
+
+        elif seconds > 0:
+            self.rate = remaining / seconds
+
+    def pause(self, seconds):
+        self.paused_until = max(
+            self.paused_until,
+            time.perf_counter() + seconds
+        )
 
 
-class Counter:
-    def __init__(self, maximum):
-        self.maximum = maximum
-        self.values = defaultdict(int)
+class GracePeriod:
+    # time based rather than counting checks, which the scheduler spaces
+    # differently for each streamer
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.started = {}
 
-    def click(self, key='__default__'):
-        self.values[key] += 1
+    def expired(self, key='__default__'):
+        now = time.perf_counter()
+        started = self.started.setdefault(key, now)
 
-        if self.values[key] > self.maximum:
-            del self.values[key]
+        if now - started >= self.seconds:
+            del self.started[key]
             return True
 
         return False
 
     def reset(self, key='__default__'):
-        self.values.pop(key, None)
+        self.started.pop(key, None)